@@ -1,24 +1,127 @@
 import subprocess
 import os
+import re
+import struct
 import logging
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 import asyncio
+import time
+import urllib.request
+from collections import deque
+
+try:
+    import pycolmap
+except ImportError:
+    pycolmap = None
 
 logger = logging.getLogger(__name__)
 
+# Above this many images exhaustive matching (O(N^2) pairs) is replaced by
+# vocabulary tree retrieval
+EXHAUSTIVE_MATCHING_MAX_IMAGES = 150
+
+VOCAB_TREE_URL = "https://demuc.de/colmap/vocab_tree_flickr100K_words32K.bin"
+VOCAB_TREE_CACHE_DIR = Path.home() / ".cache" / "colmap"
+# The download runs inside a GPU job, so a stalled server must not hold it forever:
+# seconds per socket operation, and for the whole download
+VOCAB_TREE_SOCKET_TIMEOUT = 30
+VOCAB_TREE_DOWNLOAD_TIMEOUT = 600
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+COLMAP_VERSION_RE = re.compile(r"COLMAP (\d+)\.(\d+)")
+
+# Per-item progress lines of extraction and matching, e.g. "Processed file [3/120]"
+COLMAP_PROGRESS_RE = re.compile(r"(Processed file|Matching image|Matching block) \[(\d+)/(\d+)")
+
+# Pipeline stages with an in-process pycolmap equivalent
+PYCOLMAP_COMMANDS = {
+    "feature_extractor",
+    "exhaustive_matcher",
+    "sequential_matcher",
+    "vocab_tree_matcher",
+    "mapper",
+    "image_undistorter"
+}
+
+
+def _pycolmap_options(options_type, values: Dict[str, str]):
+    """Build a pycolmap options object from COLMAP CLI option values"""
+    options = options_type()
+    for name, value in values.items():
+        current = getattr(options, name, None)
+        if current is None:
+            logger.debug(f"pycolmap {options_type.__name__} has no option {name}")
+            continue
+        try:
+            if isinstance(current, bool):
+                value = value not in ("0", "false", "False")
+            elif isinstance(current, (int, float, str)):
+                value = type(current)(value)
+            setattr(options, name, value)
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Could not set pycolmap option {name}={value}: {e}")
+    return options
+
+
+def _download(url: str, path: Path):
+    """Stream url to path, failing on a stalled or overlong download"""
+    deadline = time.monotonic() + VOCAB_TREE_DOWNLOAD_TIMEOUT
+    with urllib.request.urlopen(url, timeout=VOCAB_TREE_SOCKET_TIMEOUT) as response:
+        with open(path, "wb") as f:
+            while chunk := response.read(DOWNLOAD_CHUNK_SIZE):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Download took longer than {VOCAB_TREE_DOWNLOAD_TIMEOUT}s")
+                f.write(chunk)
+
+
+def get_gpu_count() -> int:
+    """Count the CUDA devices reported by nvidia-smi"""
+    try:
+        result = subprocess.run(
+            ["nvidia-smi", "-L"],
+            capture_output=True,
+            text=True,
+            timeout=5
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired):
+        return 0
+    if result.returncode != 0:
+        return 0
+    return sum(1 for line in result.stdout.splitlines() if line.startswith("GPU "))
+
+
 class COLMAPProcessor:
     """Wrapper for COLMAP processing pipeline"""
     
-    def __init__(self, colmap_path: str = "colmap"):
+    def __init__(
+        self,
+        colmap_path: str = "colmap",
+        use_pycolmap: bool = True,
+        websocket_manager=None
+    ):
         self.colmap_path = colmap_path
+        self.websocket_manager = websocket_manager
+        # Run stages in process (one CUDA context) when pycolmap is installed
+        self.use_pycolmap = use_pycolmap and pycolmap is not None
+        self.version: Optional[Tuple[int, int]] = None
+        self._installed: Optional[bool] = None
+        self._gpu_count: Optional[int] = None
+        # Device options moved from Sift* to Feature* in COLMAP 3.12
+        self._extraction_flag_prefix = "SiftExtraction"
+        self._matching_flag_prefix = "SiftMatching"
         
     async def process(
         self,
         images_path: str,
         output_path: str,
         camera_model: str = "PINHOLE",
-        quality: str = "high"
+        quality: str = "high",
+        matcher: str = "auto",
+        ordered: bool = False,
+        fast: bool = False,
+        max_gpus: Optional[int] = None,
+        covariant_features: bool = False
     ) -> Dict:
         """
         Process images with COLMAP
@@ -28,6 +131,12 @@ class COLMAPProcessor:
             output_path: Path for COLMAP output
             camera_model: Camera model (PINHOLE, RADIAL, OPENCV, etc.)
             quality: Processing quality (high, medium, low)
+            matcher: Matching strategy (auto, exhaustive, sequential, vocab_tree)
+            ordered: Images are sequential frames (e.g. extracted from video)
+            fast: Use the fast mapper preset regardless of quality
+            max_gpus: Limit on the number of GPUs used (default: all)
+            covariant_features: Extract covariant SIFT features, more distinctive
+                but computed on the CPU instead of the GPU
         
         Returns:
             Dictionary with processing results
@@ -44,14 +153,22 @@ class COLMAPProcessor:
             sparse_path.mkdir(parents=True, exist_ok=True)
             dense_path.mkdir(parents=True, exist_ok=True)
             
+            await self.check_colmap_installation()
+            
             logger.info("Starting COLMAP feature extraction...")
-            await self._feature_extraction(images_path, database_path, camera_model)
+            await self._feature_extraction(
+                images_path, database_path, camera_model, max_gpus, covariant_features
+            )
             
             logger.info("Starting COLMAP feature matching...")
-            await self._feature_matching(database_path, quality)
+            await self._feature_matching(
+                database_path, images_path, quality, matcher, ordered, max_gpus
+            )
             
             logger.info("Starting COLMAP sparse reconstruction...")
-            await self._sparse_reconstruction(database_path, images_path, sparse_path)
+            await self._sparse_reconstruction(
+                database_path, images_path, sparse_path, quality, fast
+            )
             
             logger.info("Starting COLMAP image undistortion...")
             await self._image_undistortion(images_path, sparse_path, dense_path)
@@ -73,31 +190,195 @@ class COLMAPProcessor:
     
     async def _run_command(self, cmd: list):
         """Run a COLMAP command asynchronously"""
+        if self.use_pycolmap and cmd[1] in PYCOLMAP_COMMANDS:
+            # pycolmap reports no per-item progress, only the finished stage
+            output = await asyncio.to_thread(self._run_pycolmap, cmd)
+            if self.websocket_manager is not None:
+                await self.websocket_manager.broadcast({
+                    "type": "colmap_progress",
+                    "stage": cmd[1],
+                    "pct": 100.0
+                })
+            return output
+        
         process = await asyncio.create_subprocess_exec(
             *cmd,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stderr=asyncio.subprocess.STDOUT
         )
         
-        stdout, stderr = await process.communicate()
+        # Stream the log instead of buffering it, keeping the tail for errors
+        tail = deque(maxlen=50)
+        async for raw_line in process.stdout:
+            line = raw_line.decode(errors="replace").rstrip()
+            logger.info(line)
+            tail.append(line)
+            
+            match = COLMAP_PROGRESS_RE.search(line)
+            if match and self.websocket_manager is not None:
+                await self.websocket_manager.broadcast({
+                    "type": "colmap_progress",
+                    "stage": cmd[1],
+                    "pct": 100.0 * int(match.group(2)) / int(match.group(3))
+                })
+        
+        await process.wait()
+        output = "\n".join(tail)
         
         if process.returncode != 0:
-            raise RuntimeError(f"COLMAP command failed: {stderr.decode()}")
+            raise RuntimeError(f"COLMAP command failed: {output}")
         
-        return stdout.decode()
+        return output
     
-    async def _feature_extraction(self, images_path: Path, database_path: Path, camera_model: str):
+    def _run_pycolmap(self, cmd: list) -> str:
+        """Run a COLMAP command through pycolmap, translating its CLI options"""
+        command = cmd[1]
+        args = {}
+        options: Dict[str, Dict[str, str]] = {}
+        for flag, value in zip(cmd[2::2], cmd[3::2]):
+            name = flag.lstrip("-")
+            if "." in name:
+                group, option = name.split(".", 1)
+                options.setdefault(group, {})[option] = value
+            else:
+                args[name] = value
+        
+        # Sift* and Feature* (COLMAP 3.12+) groups map to the same options
+        extraction = {**options.get("SiftExtraction", {}), **options.get("FeatureExtraction", {})}
+        matching = {**options.get("SiftMatching", {}), **options.get("FeatureMatching", {})}
+        
+        def device(group_options: Dict[str, str]):
+            if group_options.pop("use_gpu", "1") == "0":
+                return pycolmap.Device.cpu
+            return pycolmap.Device.auto
+        
+        if command == "feature_extractor":
+            extraction_device = device(extraction)
+            image_list = []
+            if "image_list_path" in args:
+                image_list = Path(args["image_list_path"]).read_text().splitlines()
+            pycolmap.extract_features(
+                args["database_path"],
+                args["image_path"],
+                image_list=image_list,
+                camera_model=options.get("ImageReader", {}).get("camera_model", "SIMPLE_RADIAL"),
+                sift_options=_pycolmap_options(pycolmap.SiftExtractionOptions, extraction),
+                device=extraction_device
+            )
+        elif command in ("exhaustive_matcher", "sequential_matcher", "vocab_tree_matcher"):
+            match, matching_type, group = {
+                "exhaustive_matcher": (pycolmap.match_exhaustive, "ExhaustiveMatchingOptions", "ExhaustiveMatching"),
+                "sequential_matcher": (pycolmap.match_sequential, "SequentialMatchingOptions", "SequentialMatching"),
+                "vocab_tree_matcher": (pycolmap.match_vocabtree, "VocabTreeMatchingOptions", "VocabTreeMatching")
+            }[command]
+            matching_device = device(matching)
+            match(
+                args["database_path"],
+                sift_options=_pycolmap_options(pycolmap.SiftMatchingOptions, matching),
+                matching_options=_pycolmap_options(
+                    getattr(pycolmap, matching_type), options.get(group, {})
+                ),
+                device=matching_device
+            )
+        elif command == "mapper":
+            pipeline_options = getattr(pycolmap, "IncrementalPipelineOptions", None) \
+                or pycolmap.IncrementalMapperOptions
+            pycolmap.incremental_mapping(
+                args["database_path"],
+                args["image_path"],
+                args["output_path"],
+                options=_pycolmap_options(pipeline_options, options.get("Mapper", {}))
+            )
+        elif command == "image_undistorter":
+            pycolmap.undistort_images(
+                args["output_path"],
+                args["input_path"],
+                args["image_path"],
+                output_type=args.get("output_type", "COLMAP")
+            )
+        return ""
+    
+    async def _feature_extraction(
+        self,
+        images_path: Path,
+        database_path: Path,
+        camera_model: str,
+        max_gpus: Optional[int] = None,
+        covariant_features: bool = False,
+        image_list_path: Optional[Path] = None
+    ):
         """Extract features from images"""
         cmd = [
             self.colmap_path, "feature_extractor",
             "--database_path", str(database_path),
             "--image_path", str(images_path),
             "--ImageReader.camera_model", camera_model,
-            "--SiftExtraction.use_gpu", "1"
+            f"--{self._extraction_flag_prefix}.use_gpu", "1",
+            f"--{self._extraction_flag_prefix}.num_threads", "-1",
+            "--SiftExtraction.max_num_features", "8192"
         ]
+        
+        # More distinctive features let the mapper converge with fewer bundle
+        # adjustment refinements, but COLMAP computes them with its CPU extractor
+        # whatever use_gpu says, so they are opt-in
+        if covariant_features:
+            cmd += ["--SiftExtraction.domain_size_pooling", "1"]
+            # Affine shape estimation crashes before COLMAP 3.8
+            if self.version is not None and self.version >= (3, 8):
+                cmd += ["--SiftExtraction.estimate_affine_shape", "1"]
+        
+        # COLMAP runs one extractor thread per listed device
+        gpu_index = await self._gpu_index(max_gpus)
+        if gpu_index is not None:
+            logger.info(f"Extracting features on GPUs {gpu_index}")
+            cmd += [f"--{self._extraction_flag_prefix}.gpu_index", gpu_index]
+        
+        if image_list_path is not None:
+            cmd += ["--image_list_path", str(image_list_path)]
+        
         await self._run_command(cmd)
     
-    async def _feature_matching(self, database_path: Path, quality: str):
+    async def extract_features(
+        self,
+        images_path: str,
+        database_path: str,
+        image_names: List[str],
+        camera_model: str = "PINHOLE",
+        max_gpus: Optional[int] = None,
+        covariant_features: bool = False
+    ):
+        """
+        Extract features for a subset of images into an existing database
+        
+        Images that already have features are skipped by COLMAP, so a later
+        full process() run only extracts what is still missing. The extraction
+        settings used here (camera model, GPU limit, covariant features) are
+        therefore the ones that apply to these images, not those given to
+        process() later.
+        """
+        await self.check_colmap_installation()
+        
+        database_path = Path(database_path)
+        database_path.parent.mkdir(parents=True, exist_ok=True)
+        image_list_path = database_path.with_name("image_list.txt")
+        image_list_path.write_text("".join(f"{name}\n" for name in image_names))
+        try:
+            await self._feature_extraction(
+                Path(images_path), database_path, camera_model, max_gpus,
+                covariant_features, image_list_path=image_list_path
+            )
+        finally:
+            image_list_path.unlink(missing_ok=True)
+    
+    async def _feature_matching(
+        self,
+        database_path: Path,
+        images_path: Path,
+        quality: str,
+        matcher: str = "auto",
+        ordered: bool = False,
+        max_gpus: Optional[int] = None
+    ):
         """Match features between images"""
         # Determine matching parameters based on quality
         quality_params = {
@@ -107,30 +388,126 @@ class COLMAPProcessor:
         }
         params = quality_params.get(quality, quality_params["high"])
         
-        cmd = [
-            self.colmap_path, "exhaustive_matcher",
-            "--database_path", str(database_path),
-            "--SiftMatching.use_gpu", "1",
-            "--SiftMatching.max_num_matches", str(params["max_num_matches"])
+        matcher = self._select_matcher(images_path, matcher, ordered)
+        
+        if matcher == "sequential":
+            cmd = [
+                self.colmap_path, "sequential_matcher",
+                "--database_path", str(database_path),
+                "--SequentialMatching.overlap", "10"
+            ]
+            # Loop detection needs a vocabulary tree, skip it if unavailable
+            vocab_tree_path = await self._get_vocab_tree()
+            if vocab_tree_path:
+                cmd += [
+                    "--SequentialMatching.loop_detection", "1",
+                    "--SequentialMatching.vocab_tree_path", str(vocab_tree_path)
+                ]
+            else:
+                cmd += ["--SequentialMatching.loop_detection", "0"]
+        elif matcher == "vocab_tree":
+            vocab_tree_path = await self._get_vocab_tree()
+            if vocab_tree_path:
+                cmd = [
+                    self.colmap_path, "vocab_tree_matcher",
+                    "--database_path", str(database_path),
+                    "--VocabTreeMatching.vocab_tree_path", str(vocab_tree_path),
+                    "--VocabTreeMatching.num_images", "100",
+                    "--VocabTreeMatching.num_nearest_neighbors", "5"
+                ]
+            else:
+                logger.warning("Vocabulary tree unavailable, falling back to exhaustive matching")
+                matcher = "exhaustive"
+        
+        if matcher == "exhaustive":
+            cmd = [
+                self.colmap_path, "exhaustive_matcher",
+                "--database_path", str(database_path)
+            ]
+        
+        logger.info(f"Using {matcher} matcher")
+        cmd += [
+            f"--{self._matching_flag_prefix}.use_gpu", "1",
+            f"--{self._matching_flag_prefix}.max_num_matches", str(params["max_num_matches"])
         ]
+        gpu_index = await self._gpu_index(max_gpus)
+        if gpu_index is not None:
+            cmd += [f"--{self._matching_flag_prefix}.gpu_index", gpu_index]
         await self._run_command(cmd)
     
-    async def _sparse_reconstruction(self, database_path: Path, images_path: Path, output_path: Path):
+    def _select_matcher(self, images_path: Path, matcher: str, ordered: bool) -> str:
+        """Pick a matching strategy based on the image set"""
+        if matcher in ("exhaustive", "sequential", "vocab_tree"):
+            return matcher
+        if ordered:
+            return "sequential"
+        
+        num_images = sum(1 for p in images_path.iterdir() if p.is_file())
+        if num_images > EXHAUSTIVE_MATCHING_MAX_IMAGES:
+            return "vocab_tree"
+        return "exhaustive"
+    
+    async def _get_vocab_tree(self) -> Optional[Path]:
+        """Return the cached vocabulary tree, downloading it on first use"""
+        vocab_tree_path = VOCAB_TREE_CACHE_DIR / Path(VOCAB_TREE_URL).name
+        if vocab_tree_path.exists():
+            return vocab_tree_path
+        
+        try:
+            VOCAB_TREE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            logger.info(f"Downloading vocabulary tree to {vocab_tree_path}...")
+            partial_path = vocab_tree_path.with_suffix(".part")
+            try:
+                await asyncio.to_thread(_download, VOCAB_TREE_URL, partial_path)
+            except Exception:
+                partial_path.unlink(missing_ok=True)
+                raise
+            partial_path.rename(vocab_tree_path)
+            return vocab_tree_path
+        except Exception as e:
+            logger.warning(f"Could not download vocabulary tree: {e}")
+            return None
+    
+    async def _sparse_reconstruction(
+        self,
+        database_path: Path,
+        images_path: Path,
+        output_path: Path,
+        quality: str = "high",
+        fast: bool = False
+    ):
         """Perform sparse reconstruction"""
+        # Fewer global bundle adjustments with fewer iterations ("COLMAP fast")
+        fast_params = {
+            "ba_global_images_ratio": 1.32,
+            "ba_global_points_ratio": 1.32,
+            "ba_global_points_freq": 500000,
+            "ba_global_max_num_iterations": 10,
+            "ba_global_max_refinements": 2,
+            "ba_local_max_num_iterations": 15
+        }
+        quality_params = {
+            "high": {},
+            "medium": {},
+            "low": fast_params
+        }
+        params = fast_params if fast else quality_params.get(quality, quality_params["high"])
+        
         cmd = [
             self.colmap_path, "mapper",
             "--database_path", str(database_path),
             "--image_path", str(images_path),
             "--output_path", str(output_path)
         ]
+        for name, value in params.items():
+            cmd += [f"--Mapper.{name}", str(value)]
         await self._run_command(cmd)
     
     async def _image_undistortion(self, images_path: Path, sparse_path: Path, dense_path: Path):
         """Undistort images for dense reconstruction"""
-        # Find the reconstruction folder (usually 0)
-        reconstruction_path = sparse_path / "0"
-        if not reconstruction_path.exists():
-            reconstruction_path = list(sparse_path.glob("*"))[0]
+        reconstruction_path = self._largest_reconstruction(sparse_path)
+        if reconstruction_path is None:
+            raise RuntimeError(f"No sparse reconstruction found in {sparse_path}")
         
         cmd = [
             self.colmap_path, "image_undistorter",
@@ -141,14 +518,50 @@ class COLMAPProcessor:
         ]
         await self._run_command(cmd)
     
-    async def dense_reconstruction(self, dense_path: Path):
+    @staticmethod
+    def _largest_reconstruction(sparse_path: Path) -> Optional[Path]:
+        """Pick the sub-reconstruction with the most 3D points (by file size)"""
+        def points_size(path: Path) -> int:
+            for name in ("points3D.bin", "points3D.txt"):
+                points_file = path / name
+                if points_file.exists():
+                    return points_file.stat().st_size
+            return 0
+        
+        # The mapper may split the scene; sort by name first for determinism
+        reconstructions = sorted(p for p in sparse_path.iterdir() if p.is_dir())
+        return max(reconstructions, key=points_size, default=None)
+    
+    async def dense_reconstruction(
+        self,
+        dense_path: Path,
+        quality: str = "normal",
+        max_gpus: Optional[int] = None
+    ):
         """Perform dense reconstruction (optional, time-consuming)"""
+        # Downscaling images is the main speed/quality knob for PatchMatch
+        quality_params = {
+            "draft": {"max_image_size": 1000, "window_radius": 3, "num_samples": 10},
+            "normal": {"max_image_size": 2000, "window_radius": 5, "num_samples": 15},
+            "extreme": {"max_image_size": -1, "window_radius": 5, "num_samples": 15}
+        }
+        params = quality_params.get(quality, quality_params["normal"])
+        
+        # Spread stereo problems across all GPUs
+        num_gpus = await self.get_gpu_count()
+        if max_gpus is not None:
+            num_gpus = min(num_gpus, max_gpus)
+        gpu_index = ",".join(str(i) for i in range(max(num_gpus, 1)))
+        
         # Stereo matching
         cmd = [
             self.colmap_path, "patch_match_stereo",
             "--workspace_path", str(dense_path),
-            "--PatchMatchStereo.gpu_index", "0"
+            "--PatchMatchStereo.gpu_index", gpu_index,
+            "--PatchMatchStereo.cache_size", "64"
         ]
+        for name, value in params.items():
+            cmd += [f"--PatchMatchStereo.{name}", str(value)]
         await self._run_command(cmd)
         
         # Stereo fusion
@@ -162,32 +575,14 @@ class COLMAPProcessor:
     def _get_statistics(self, sparse_path: Path) -> Dict:
         """Get reconstruction statistics"""
         try:
-            # Find the reconstruction folder
-            reconstruction_path = sparse_path / "0"
-            if not reconstruction_path.exists():
-                reconstruction_path = list(sparse_path.glob("*"))[0]
+            reconstruction_path = self._largest_reconstruction(sparse_path)
+            if reconstruction_path is None:
+                return {}
             
-            # Count images and points
-            cameras_file = reconstruction_path / "cameras.txt"
-            images_file = reconstruction_path / "images.txt"
-            points_file = reconstruction_path / "points3D.txt"
-            
-            num_cameras = 0
-            num_images = 0
-            num_points = 0
-            
-            if cameras_file.exists():
-                with open(cameras_file) as f:
-                    num_cameras = sum(1 for line in f if not line.startswith("#"))
-            
-            if images_file.exists():
-                with open(images_file) as f:
-                    lines = [line for line in f if not line.startswith("#")]
-                    num_images = len(lines) // 2  # Each image has 2 lines
-            
-            if points_file.exists():
-                with open(points_file) as f:
-                    num_points = sum(1 for line in f if not line.startswith("#"))
+            # Count cameras, images and points
+            num_cameras = self._count_model_entries(reconstruction_path, "cameras")
+            num_images = self._count_model_entries(reconstruction_path, "images", 2)
+            num_points = self._count_model_entries(reconstruction_path, "points3D")
             
             return {
                 "num_cameras": num_cameras,
@@ -198,14 +593,96 @@ class COLMAPProcessor:
             logger.warning(f"Could not get statistics: {e}")
             return {}
     
-    def check_colmap_installation(self) -> bool:
-        """Check if COLMAP is installed"""
+    def _count_model_entries(
+        self,
+        reconstruction_path: Path,
+        name: str,
+        lines_per_entry: int = 1
+    ) -> int:
+        """Count the entries of a COLMAP model file, preferring the binary format"""
+        binary_file = reconstruction_path / f"{name}.bin"
+        if binary_file.exists():
+            # Binary models start with the entry count as a uint64
+            with open(binary_file, "rb") as f:
+                return struct.unpack("<Q", f.read(8))[0]
+        
+        text_file = reconstruction_path / f"{name}.txt"
+        if text_file.exists():
+            return self._count_data_lines(text_file) // lines_per_entry
+        
+        return 0
+    
+    @staticmethod
+    def _count_data_lines(path: Path) -> int:
+        """Count the lines of a COLMAP text file, excluding its # header"""
+        total = 0
+        last = b"\n"
+        with open(path, "rb") as f:
+            # COLMAP only writes comments in the leading header
+            for line in f:
+                if not line.startswith(b"#"):
+                    total = 1 if line.endswith(b"\n") else 0
+                    last = line[-1:]
+                    break
+            
+            # Count the remaining newlines a block at a time
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                total += chunk.count(b"\n")
+                last = chunk[-1:]
+        
+        if last != b"\n":
+            total += 1
+        return total
+    
+    async def _gpu_index(self, max_gpus: Optional[int]) -> Optional[str]:
+        """COLMAP gpu_index for a GPU limit, None to leave COLMAP's default"""
+        # The default gpu_index of -1 already uses every device
+        if max_gpus is None:
+            return None
+        num_gpus = await self.get_gpu_count()
+        # Without nvidia-smi the count is unknown, trust the limit
+        if num_gpus:
+            num_gpus = min(num_gpus, max_gpus)
+        else:
+            num_gpus = max_gpus
+        return ",".join(str(i) for i in range(max(num_gpus, 1)))
+    
+    async def get_gpu_count(self) -> int:
+        """Count local GPUs (cached after the first call)"""
+        if self._gpu_count is None:
+            # nvidia-smi can take seconds, keep it off the event loop
+            self._gpu_count = await asyncio.to_thread(get_gpu_count)
+        return self._gpu_count
+    
+    async def check_colmap_installation(self) -> bool:
+        """Check if COLMAP is installed (cached after the first call)"""
+        if self._installed is None:
+            # colmap --version may take up to its timeout, keep it off the event loop
+            self._installed = await asyncio.to_thread(self._detect_colmap)
+        return self._installed
+    
+    def _detect_colmap(self) -> bool:
+        """Run colmap --version and record the installed version"""
         try:
             result = subprocess.run(
                 [self.colmap_path, "--version"],
                 capture_output=True,
-                text=True
+                text=True,
+                timeout=5
             )
-            return result.returncode == 0
+            if result.returncode != 0:
+                return False
+            
+            match = COLMAP_VERSION_RE.search(result.stdout + result.stderr)
+            if match:
+                self.version = (int(match.group(1)), int(match.group(2)))
+                if self.version >= (3, 12):
+                    self._extraction_flag_prefix = "FeatureExtraction"
+                    self._matching_flag_prefix = "FeatureMatching"
+                logger.info(f"Detected COLMAP {self.version[0]}.{self.version[1]}")
+            return True
         except FileNotFoundError:
-            return False
\ No newline at end of file
+            return False
+        except subprocess.TimeoutExpired:
+            logger.warning(f"{self.colmap_path} --version timed out")
+            return False
@@ -1,13 +1,132 @@
 import asyncio
+import importlib.util
 import subprocess
 import logging
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 import trimesh
 import numpy as np
+import scipy.sparse
+
+try:
+    import cupy
+    import cupyx.scipy.sparse
+except ImportError:
+    cupy = None
 
 logger = logging.getLogger(__name__)
 
+# trimesh decimates through open3d, which is optional and heavy to import,
+# so only check that it is installed
+HAS_OPEN3D = importlib.util.find_spec("open3d") is not None
+
+
+def _cuda_available() -> bool:
+    """Check whether CuPy can use a GPU"""
+    if cupy is None:
+        return False
+    try:
+        return cupy.cuda.runtime.getDeviceCount() > 0
+    except Exception:
+        return False
+
+
+def laplacian_smooth(
+    mesh: trimesh.Trimesh,
+    iterations: int = 5,
+    lamb: float = 0.5
+) -> trimesh.Trimesh:
+    """
+    Laplacian smoothing with a single precomputed sparse operator
+    
+    Same explicit umbrella scheme and volume constraint as
+    trimesh.smoothing.filter_laplacian, but each iteration is one SpMV.
+    """
+    num_vertices = len(mesh.vertices)
+    edges = mesh.edges_unique
+    rows = np.concatenate([edges[:, 0], edges[:, 1]])
+    cols = np.concatenate([edges[:, 1], edges[:, 0]])
+    
+    # Row-normalised adjacency; isolated vertices map onto themselves
+    degree = np.bincount(rows, minlength=num_vertices)
+    isolated = np.flatnonzero(degree == 0)
+    rows = np.concatenate([rows, isolated])
+    cols = np.concatenate([cols, isolated])
+    weights = 1.0 / np.maximum(degree, 1)[rows]
+    operator = scipy.sparse.csr_matrix(
+        (weights, (rows, cols)), shape=(num_vertices, num_vertices)
+    )
+    
+    volume = mesh.volume
+    
+    vertices = np.array(mesh.vertices, dtype=np.float64)
+    if _cuda_available():
+        operator = cupyx.scipy.sparse.csr_matrix(operator)
+        vertices = cupy.asarray(vertices)
+        for _ in range(iterations):
+            vertices += lamb * (operator @ vertices - vertices)
+        vertices = cupy.asnumpy(vertices)
+    else:
+        for _ in range(iterations):
+            vertices += lamb * (operator @ vertices - vertices)
+    
+    # The update is linear, so restoring the volume once is equivalent to
+    # restoring it after every iteration
+    new_volume = trimesh.triangles.mass_properties(
+        vertices[mesh.faces], skip_inertia=True
+    )["volume"]
+    if volume * new_volume > 0:
+        vertices *= (volume / new_volume) ** (1.0 / 3.0)
+    
+    mesh.vertices = vertices
+    return mesh
+
+
+def write_ply_binary(
+    path: Path,
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    colors: Optional[np.ndarray] = None
+):
+    """Write a triangle mesh as binary little-endian PLY with one write per element"""
+    vertex_dtype = [("xyz", "<f4", 3)]
+    header = [
+        "ply",
+        "format binary_little_endian 1.0",
+        f"element vertex {len(vertices)}",
+        "property float x",
+        "property float y",
+        "property float z"
+    ]
+    if colors is not None:
+        vertex_dtype.append(("rgba", "u1", 4))
+        header += [
+            "property uchar red",
+            "property uchar green",
+            "property uchar blue",
+            "property uchar alpha"
+        ]
+    header += [
+        f"element face {len(faces)}",
+        "property list uchar int vertex_indices",
+        "end_header"
+    ]
+    
+    vertex_data = np.empty(len(vertices), dtype=vertex_dtype)
+    vertex_data["xyz"] = vertices
+    if colors is not None:
+        vertex_data["rgba"] = colors
+    
+    face_data = np.empty(len(faces), dtype=[("count", "u1"), ("indices", "<i4", 3)])
+    face_data["count"] = 3
+    face_data["indices"] = faces
+    
+    with open(path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        f.write(vertex_data.tobytes())
+        f.write(face_data.tobytes())
+
+
 class MeshExtractor:
     """Extract and process meshes from trained Neuralangelo models"""
     
@@ -21,7 +140,8 @@ class MeshExtractor:
         resolution: int = 2048,
         block_resolution: int = 128,
         threshold: float = 0.005,
-        export_formats: List[str] = ["ply", "obj"]
+        export_formats: List[str] = ["ply", "obj"],
+        target_faces: Optional[int] = None
     ) -> Dict:
         """
         Extract mesh from trained model
@@ -33,6 +153,7 @@ class MeshExtractor:
             block_resolution: Block resolution for memory efficiency
             threshold: Isosurface threshold
             export_formats: List of export formats
+            target_faces: Decimate to this face count before smoothing
         
         Returns:
             Dictionary with extraction results
@@ -58,26 +179,31 @@ class MeshExtractor:
                 block_resolution,
                 threshold
             )
+            mesh = trimesh.load(output_mesh)
             
             # Post-process mesh
             logger.info("Post-processing mesh...")
-            mesh = trimesh.load(output_mesh)
-            mesh = self._post_process_mesh(mesh)
+            mesh = self._post_process_mesh(mesh, target_faces)
             
-            # Export to different formats
+            # Export to different formats concurrently, the mesh is only read
+            exports = []
             exported_files = []
             for fmt in export_formats:
                 output_file = meshes_path / f"mesh_{checkpoint}.{fmt}"
                 logger.info(f"Exporting to {fmt}...")
                 
                 if fmt == "ply":
-                    mesh.export(output_file)
-                elif fmt == "obj":
-                    mesh.export(output_file)
-                elif fmt == "glb":
-                    mesh.export(output_file)
+                    colors = None
+                    if mesh.visual.kind == "vertex":
+                        colors = mesh.visual.vertex_colors
+                    exports.append(asyncio.to_thread(
+                        write_ply_binary, output_file, mesh.vertices, mesh.faces, colors
+                    ))
+                elif fmt in ("obj", "glb"):
+                    exports.append(asyncio.to_thread(mesh.export, output_file))
                 
                 exported_files.append(str(output_file))
+            await asyncio.gather(*exports)
             
             # Get mesh statistics
             stats = self._get_mesh_statistics(mesh)
@@ -144,13 +270,23 @@ class MeshExtractor:
         
         logger.info(stdout.decode())
     
-    def _post_process_mesh(self, mesh: trimesh.Trimesh) -> trimesh.Trimesh:
+    def _post_process_mesh(
+        self,
+        mesh: trimesh.Trimesh,
+        target_faces: Optional[int] = None
+    ) -> trimesh.Trimesh:
         """Post-process extracted mesh"""
         # Remove disconnected components
-        components = mesh.split(only_watertight=False)
+        components = trimesh.graph.connected_components(
+            mesh.face_adjacency, nodes=np.arange(len(mesh.faces))
+        )
         if len(components) > 1:
-            # Keep the largest component
-            mesh = max(components, key=lambda m: len(m.vertices))
+            # Keep the largest component, masking faces instead of copying each part
+            largest = max(components, key=len)
+            mask = np.zeros(len(mesh.faces), dtype=bool)
+            mask[largest] = True
+            mesh.update_faces(mask)
+            mesh.remove_unreferenced_vertices()
             logger.info(f"Removed {len(components) - 1} disconnected components")
         
         # Remove duplicate vertices
@@ -159,9 +295,20 @@ class MeshExtractor:
         # Remove degenerate faces
         mesh.remove_degenerate_faces()
         
+        # Decimate first so smoothing runs on the reduced mesh
+        if target_faces and len(mesh.faces) > target_faces:
+            if HAS_OPEN3D:
+                mesh = mesh.simplify_quadric_decimation(target_faces)
+                logger.info(f"Decimated mesh: {len(mesh.faces)} faces")
+            else:
+                logger.warning(
+                    f"open3d is not installed, keeping all {len(mesh.faces)} faces "
+                    f"instead of decimating to {target_faces}"
+                )
+        
         # Smooth mesh (Laplacian smoothing)
         # Note: This is a simple smoothing, adjust iterations as needed
-        mesh = trimesh.smoothing.filter_laplacian(mesh, iterations=5)
+        mesh = laplacian_smooth(mesh, iterations=5)
         
         # Fix normals
         mesh.fix_normals()
@@ -170,13 +317,14 @@ class MeshExtractor:
     
     def _get_mesh_statistics(self, mesh: trimesh.Trimesh) -> Dict:
         """Get mesh statistics"""
+        watertight = mesh.is_watertight
         return {
-            "vertices": len(mesh.vertices),
-            "faces": len(mesh.faces),
+            "vertices": mesh.vertices.shape[0],
+            "faces": mesh.faces.shape[0],
             "bounds": mesh.bounds.tolist(),
             "extents": mesh.extents.tolist(),
-            "is_watertight": mesh.is_watertight,
-            "volume": float(mesh.volume) if mesh.is_watertight else None,
+            "is_watertight": watertight,
+            "volume": float(mesh.volume) if watertight else None,
             "area": float(mesh.area)
         }
     
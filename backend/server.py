@@ -1,15 +1,16 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File, BackgroundTasks
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Tuple
 import asyncio
-import json
 import os
-import shutil
 from pathlib import Path
 from datetime import datetime
 import logging
+import aiofiles
+import orjson
 
 from colmap_wrapper import COLMAPProcessor
 from training_manager import TrainingManager
@@ -19,7 +20,13 @@ from mesh_extractor import MeshExtractor
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Neuralangelo GUI API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Don't leave trainers holding the GPU after the API exits
+    await training_manager.stop_all()
+
+app = FastAPI(title="Neuralangelo GUI API", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -34,6 +41,31 @@ app.add_middleware(
 active_connections: List[WebSocket] = []
 projects_dir = Path("./projects")
 projects_dir.mkdir(exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Streaming feature extraction: queued image names and worker per project
+FEATURE_BATCH_SIZE = 32
+feature_queues: Dict[str, asyncio.Queue] = {}
+feature_workers: Dict[str, asyncio.Task] = {}
+
+# GPU jobs (COLMAP, training, mesh extraction) run one per project, and at most
+# MAX_GPU_JOBS at a time across projects
+gpu_semaphore = asyncio.Semaphore(int(os.getenv("MAX_GPU_JOBS", "1")))
+gpu_jobs: Dict[str, asyncio.Task] = {}
+
+# Parsed project configs keyed by path, with the mtime they were read at
+_config_cache: Dict[Path, Tuple[int, Dict]] = {}
+
+def read_project_config(config_file: Path) -> Dict:
+    """Load a project config.json, reusing the parsed copy while unchanged"""
+    mtime = config_file.stat().st_mtime_ns
+    cached = _config_cache.get(config_file)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    
+    config = orjson.loads(config_file.read_bytes())
+    _config_cache[config_file] = (mtime, config)
+    return config
 
 # Pydantic models
 class ProjectConfig(BaseModel):
@@ -46,10 +78,16 @@ class ProjectConfig(BaseModel):
     hash_encoding_levels: int = 16
     learning_rate: float = 0.001
     batch_size: int = 4
+    cpu_affinity: Optional[List[int]] = None
 
 class COLMAPConfig(BaseModel):
     camera_model: str = "PINHOLE"
     quality: str = "high"
+    matcher: str = "auto"
+    ordered: bool = False
+    fast: bool = False
+    max_gpus: Optional[int] = None
+    covariant_features: bool = False
     dense_reconstruction: bool = True
     generate_point_cloud: bool = True
 
@@ -60,31 +98,75 @@ class MeshExtractionConfig(BaseModel):
     threshold: float = 0.005
     export_formats: List[str] = ["ply", "obj"]
     post_process: bool = True
+    target_faces: Optional[int] = None
 
 # WebSocket connection manager
+# Messages waiting per client; a client that falls further behind loses frames
+WS_QUEUE_SIZE = 256
+# A client that takes longer than this to accept one frame is dropped
+WS_SEND_TIMEOUT = 0.5
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
+        self._queues: Dict[WebSocket, asyncio.Queue] = {}
+        self._writers: Dict[WebSocket, asyncio.Task] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
+        self._queues[websocket] = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self._writers[websocket] = asyncio.create_task(self._writer(websocket))
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        self._queues.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+
+    @property
+    def client_count(self) -> int:
+        return len(self.active_connections)
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections:
+        # Nobody to send to, skip the encode
+        if self.client_count:
+            await self.broadcast_bytes(orjson.dumps(message))
+
+    async def broadcast_bytes(self, payload: bytes):
+        """Queue an already JSON-encoded message for every client without waiting on sends"""
+        # Text frames, the GUI parses event.data as a JSON string
+        payload = payload.decode()
+        for queue in list(self._queues.values()):
+            if not queue.full():
+                queue.put_nowait(payload)
+
+    async def _writer(self, websocket: WebSocket):
+        """Drain one client's queue so a slow client only delays itself"""
+        queue = self._queues[websocket]
+        try:
+            while True:
+                payload = await queue.get()
+                await asyncio.wait_for(websocket.send_text(payload), WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Dropping WebSocket client: {e}")
+            self.disconnect(websocket)
+            # Close the socket too, so the GUI sees onclose and reconnects
+            # instead of staying connected with nothing being sent to it
             try:
-                await connection.send_json(message)
-            except:
+                await asyncio.wait_for(websocket.close(), WS_SEND_TIMEOUT)
+            except Exception:
                 pass
 
 manager = ConnectionManager()
 
 # Initialize managers
 training_manager = TrainingManager()
-colmap_processor = COLMAPProcessor()
+colmap_processor = COLMAPProcessor(websocket_manager=manager)
 mesh_extractor = MeshExtractor()
 
 @app.get("/")
@@ -106,8 +188,7 @@ async def create_project(config: ProjectConfig):
         
         # Save config
         config_file = project_path / "config.json"
-        with open(config_file, 'w') as f:
-            json.dump(config.dict(), f, indent=2)
+        config_file.write_bytes(orjson.dumps(config.dict(), option=orjson.OPT_INDENT_2))
         
         logger.info(f"Created project: {config.scene_name}")
         return {"status": "success", "project_path": str(project_path)}
@@ -115,28 +196,130 @@ async def create_project(config: ProjectConfig):
         logger.error(f"Error creating project: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def gpu_job_running(project_name: str) -> bool:
+    """Whether a GPU job is queued or running for the project"""
+    task = gpu_jobs.get(project_name)
+    return task is not None and not task.done()
+
+def schedule_gpu_job(project_name: str, job):
+    """Start a GPU job in the background once a GPU slot is free"""
+    if gpu_job_running(project_name):
+        raise HTTPException(status_code=409, detail=f"A job is already running for {project_name}")
+    
+    async def run():
+        # Streamed extraction writes the project's database, let it finish
+        # first (outside the semaphore, its batches take the semaphore too)
+        worker = feature_workers.get(project_name)
+        if worker:
+            await worker
+        async with gpu_semaphore:
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"GPU job failed for {project_name}: {e}")
+    
+    gpu_jobs[project_name] = asyncio.create_task(run())
+
+def queue_feature_extraction(project_name: str, image_name: str, options: Dict) -> bool:
+    """Queue an uploaded image for streaming feature extraction, False if it was dropped"""
+    # A job accepted while the upload was still saving files may already be
+    # using the database, or be done with extraction
+    if gpu_job_running(project_name):
+        logger.warning(f"Not extracting {image_name}, a job is running for {project_name}")
+        return False
+    queue = feature_queues.setdefault(project_name, asyncio.Queue())
+    queue.put_nowait(image_name)
+    if project_name not in feature_workers:
+        feature_workers[project_name] = asyncio.create_task(
+            feature_extraction_worker(project_name, options)
+        )
+    return True
+
+async def feature_extraction_worker(project_name: str, options: Dict):
+    """
+    Extract features for queued uploads in batches until the queue drains
+    
+    options are the extract_features settings of the upload that started the
+    worker; they apply to every image queued until the queue drains.
+    """
+    project_path = projects_dir / project_name
+    queue = feature_queues[project_name]
+    try:
+        while not queue.empty():
+            batch = [queue.get_nowait() for _ in range(min(queue.qsize(), FEATURE_BATCH_SIZE))]
+            try:
+                # Per batch, so other projects' GPU jobs can run in between
+                async with gpu_semaphore:
+                    await colmap_processor.extract_features(
+                        images_path=str(project_path / "images"),
+                        database_path=str(project_path / "colmap" / "database.db"),
+                        image_names=batch,
+                        **options
+                    )
+                logger.info(f"Extracted features for {len(batch)} streamed images in {project_name}")
+            except Exception as e:
+                logger.error(f"Streaming feature extraction failed: {e}")
+    finally:
+        del feature_workers[project_name]
+
 @app.post("/api/projects/{project_name}/upload-images")
-async def upload_images(project_name: str, files: List[UploadFile] = File(...)):
-    """Upload images to project"""
+async def upload_images(
+    project_name: str,
+    files: List[UploadFile] = File(...),
+    streaming: bool = False,
+    camera_model: str = "PINHOLE",
+    max_gpus: Optional[int] = None,
+    covariant_features: bool = False
+):
+    """
+    Upload images to project, optionally extracting features as they arrive
+    
+    Streamed images keep the extraction settings given here, process-colmap
+    does not extract them again.
+    """
     try:
+        # Extraction would write the database while COLMAP or training uses it
+        if streaming and gpu_job_running(project_name):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Cannot stream uploads while a job is running for {project_name}"
+            )
+        
         project_path = projects_dir / project_name
         images_path = project_path / "images"
+        options = {
+            "camera_model": camera_model,
+            "max_gpus": max_gpus,
+            "covariant_features": covariant_features
+        }
         
-        uploaded_files = []
-        for file in files:
+        not_extracted = []
+        
+        async def save_upload(file: UploadFile) -> str:
             file_path = images_path / file.filename
-            with open(file_path, 'wb') as f:
-                shutil.copyfileobj(file.file, f)
-            uploaded_files.append(file.filename)
+            async with aiofiles.open(file_path, 'wb') as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+            if streaming and not queue_feature_extraction(project_name, file.filename, options):
+                not_extracted.append(file.filename)
+            return file.filename
+        
+        # Write all files concurrently without blocking the event loop
+        uploaded_files = await asyncio.gather(*[save_upload(file) for file in files])
         
         logger.info(f"Uploaded {len(uploaded_files)} images to {project_name}")
-        return {"status": "success", "files": uploaded_files}
+        response = {"status": "success", "files": uploaded_files}
+        if streaming:
+            response["not_extracted"] = not_extracted
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading images: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/projects/{project_name}/process-colmap")
-async def process_colmap(project_name: str, config: COLMAPConfig, background_tasks: BackgroundTasks):
+async def process_colmap(project_name: str, config: COLMAPConfig):
     """Process images with COLMAP"""
     try:
         project_path = projects_dir / project_name
@@ -153,7 +336,12 @@ async def process_colmap(project_name: str, config: COLMAPConfig, background_tas
                     images_path=str(project_path / "images"),
                     output_path=str(project_path / "colmap"),
                     camera_model=config.camera_model,
-                    quality=config.quality
+                    quality=config.quality,
+                    matcher=config.matcher,
+                    ordered=config.ordered,
+                    fast=config.fast,
+                    max_gpus=config.max_gpus,
+                    covariant_features=config.covariant_features
                 )
                 
                 await manager.broadcast({
@@ -169,14 +357,16 @@ async def process_colmap(project_name: str, config: COLMAPConfig, background_tas
                     "message": f"COLMAP error: {str(e)}"
                 })
         
-        background_tasks.add_task(process_task)
+        schedule_gpu_job(project_name, process_task)
         return {"status": "started"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error starting COLMAP: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/projects/{project_name}/train")
-async def start_training(project_name: str, config: ProjectConfig, background_tasks: BackgroundTasks):
+async def start_training(project_name: str, config: ProjectConfig):
     """Start training"""
     try:
         project_path = projects_dir / project_name
@@ -187,9 +377,13 @@ async def start_training(project_name: str, config: ProjectConfig, background_ta
                 config=config.dict(),
                 websocket_manager=manager
             )
+            # Hold the GPU slot until the trainer exits
+            await training_manager.wait_for_training(config.scene_name)
         
-        background_tasks.add_task(train_task)
+        schedule_gpu_job(project_name, train_task)
         return {"status": "started"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error starting training: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -222,7 +416,7 @@ async def stop_training(project_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/projects/{project_name}/extract-mesh")
-async def extract_mesh(project_name: str, config: MeshExtractionConfig, background_tasks: BackgroundTasks):
+async def extract_mesh(project_name: str, config: MeshExtractionConfig):
     """Extract mesh from trained model"""
     try:
         project_path = projects_dir / project_name
@@ -241,7 +435,8 @@ async def extract_mesh(project_name: str, config: MeshExtractionConfig, backgrou
                     resolution=config.resolution,
                     block_resolution=config.block_resolution,
                     threshold=config.threshold,
-                    export_formats=config.export_formats
+                    export_formats=config.export_formats,
+                    target_faces=config.target_faces
                 )
                 
                 await manager.broadcast({
@@ -257,8 +452,10 @@ async def extract_mesh(project_name: str, config: MeshExtractionConfig, backgrou
                     "message": f"Extraction error: {str(e)}"
                 })
         
-        background_tasks.add_task(extract_task)
+        schedule_gpu_job(project_name, extract_task)
         return {"status": "started"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error starting mesh extraction: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -273,8 +470,7 @@ async def get_project_status(project_name: str):
         
         config_file = project_path / "config.json"
         if config_file.exists():
-            with open(config_file) as f:
-                config = json.load(f)
+            config = read_project_config(config_file)
         else:
             config = {}
         
@@ -285,7 +481,8 @@ async def get_project_status(project_name: str):
             "config": config,
             "training": training_status,
             "has_colmap": (project_path / "colmap" / "sparse").exists(),
-            "checkpoints": list((project_path / "checkpoints").glob("*.pth"))
+            # Polled by the UI, the listing is cached until the directory changes
+            "checkpoints": training_manager.list_checkpoints(str(project_path))
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -299,8 +496,7 @@ async def list_projects():
             if project_path.is_dir():
                 config_file = project_path / "config.json"
                 if config_file.exists():
-                    with open(config_file) as f:
-                        config = json.load(f)
+                    config = read_project_config(config_file)
                     projects.append({
                         "name": project_path.name,
                         "path": str(project_path),
@@ -336,7 +532,8 @@ async def websocket_endpoint(websocket: WebSocket):
             data = await websocket.receive_text()
             # Echo back for heartbeat
             await websocket.send_json({"type": "heartbeat", "timestamp": datetime.now().isoformat()})
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError once the manager has closed a client that stopped reading
         manager.disconnect(websocket)
 
 if __name__ == "__main__":
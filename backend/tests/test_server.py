@@ -1,9 +1,10 @@
 import pytest
+import pytest_asyncio
+import httpx
+import asyncio
 from fastapi.testclient import TestClient
 from pathlib import Path
 import json
-import tempfile
-import shutil
 
 # Assuming server.py is in the backend directory
 import sys
@@ -11,14 +12,24 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from server import app
 
-client = TestClient(app)
+@pytest.fixture(scope="session")
+def client():
+    """One TestClient for the whole suite, so app startup runs once"""
+    with TestClient(app) as c:
+        yield c
+
+@pytest_asyncio.fixture
+async def async_client():
+    """In-process ASGI client, requests run on the test's event loop"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        yield c
 
 @pytest.fixture
-def temp_project_dir():
+def temp_project_dir(tmp_path_factory, request):
     """Create a temporary project directory for testing"""
-    temp_dir = tempfile.mkdtemp()
-    yield temp_dir
-    shutil.rmtree(temp_dir)
+    # pytest removes the whole base temp directory itself, no per-test rmtree
+    return str(tmp_path_factory.mktemp(request.node.name))
 
 @pytest.fixture
 def sample_project_config():
@@ -38,40 +49,181 @@ def sample_project_config():
 class TestAPI:
     """Test API endpoints"""
     
-    def test_root_endpoint(self):
+    @pytest.mark.asyncio
+    async def test_root_endpoint(self, async_client):
         """Test root endpoint returns correct response"""
-        response = client.get("/")
+        response = await async_client.get("/")
         assert response.status_code == 200
         data = response.json()
         assert data["message"] == "Neuralangelo GUI API"
         assert "version" in data
     
-    def test_create_project(self, sample_project_config, temp_project_dir):
+    @pytest.mark.asyncio
+    async def test_create_project(self, async_client, sample_project_config, temp_project_dir):
         """Test project creation"""
         # Update config with temp directory
         config = sample_project_config.copy()
         config["project_path"] = temp_project_dir
         
-        response = client.post("/api/projects/create", json=config)
+        response = await async_client.post("/api/projects/create", json=config)
         assert response.status_code == 200
         data = response.json()
         assert data["status"] == "success"
         assert "project_path" in data
     
-    def test_list_projects_empty(self):
+    @pytest.mark.asyncio
+    async def test_list_projects_empty(self, async_client):
         """Test listing projects when none exist"""
-        response = client.get("/api/projects")
+        response = await async_client.get("/api/projects")
         assert response.status_code == 200
         data = response.json()
         assert "projects" in data
         assert isinstance(data["projects"], list)
     
-    def test_invalid_project_name(self):
+    @pytest.mark.asyncio
+    async def test_project_status_lists_checkpoints(self, async_client, monkeypatch, tmp_path):
+        """Test project status lists checkpoint names through the training manager"""
+        import server
+
+        monkeypatch.setattr(server, "projects_dir", tmp_path)
+        checkpoint_path = tmp_path / "status_project" / "checkpoints"
+        checkpoint_path.mkdir(parents=True)
+        (checkpoint_path / "iter_10000.pth").touch()
+
+        response = await async_client.get("/api/projects/status_project/status")
+        assert response.status_code == 200
+        assert response.json()["checkpoints"] == ["iter_10000.pth"]
+    
+    @pytest.mark.asyncio
+    async def test_project_status_of_running_training(self, async_client, monkeypatch, tmp_path):
+        """Test project status serves training progress without the process handles"""
+        import server
+
+        monkeypatch.setattr(server, "projects_dir", tmp_path)
+        (tmp_path / "training_project").mkdir()
+        monkeypatch.setitem(server.training_manager.active_trainings, "training_project", {
+            "process": object(),
+            "psutil": object(),
+            "status": "running",
+            "iteration": 500,
+            "loss": 0.25,
+            "cpu_percent": 95.0,
+            "memory_rss": 1 << 30
+        })
+
+        response = await async_client.get("/api/projects/training_project/status")
+        assert response.status_code == 200
+        assert response.json()["training"] == {
+            "status": "running",
+            "iteration": 500,
+            "loss": 0.25,
+            "cpu_percent": 95.0,
+            "memory_rss": 1 << 30
+        }
+    
+    @pytest.mark.asyncio
+    async def test_invalid_project_name(self, async_client):
         """Test error handling for invalid project"""
-        response = client.get("/api/projects/nonexistent_project/status")
+        response = await async_client.get("/api/projects/nonexistent_project/status")
         assert response.status_code == 404
 
 
+class TestGPUJobs:
+    """Test GPU job scheduling"""
+    
+    def test_duplicate_job_rejected(self, client, monkeypatch):
+        """Test a second GPU job for the same project is rejected while one runs"""
+        import asyncio
+        import server
+
+        async def slow_process(**kwargs):
+            await asyncio.sleep(0.2)
+            return {}
+
+        monkeypatch.setattr(server.colmap_processor, "process", slow_process)
+        first = client.post("/api/projects/job_project/process-colmap", json={})
+        second = client.post("/api/projects/job_project/process-colmap", json={})
+        assert first.status_code == 200
+        assert second.status_code == 409
+
+        # Once the first job finishes the project accepts new jobs
+        client.portal.call(asyncio.sleep, 0.3)
+        third = client.post("/api/projects/job_project/process-colmap", json={})
+        assert third.status_code == 200
+        client.portal.call(asyncio.sleep, 0.3)
+
+    def test_streaming_upload_rejected_during_job(self, client, monkeypatch):
+        """Test streamed extraction cannot start while a GPU job uses the project"""
+        import asyncio
+        import server
+
+        async def slow_process(**kwargs):
+            await asyncio.sleep(0.2)
+            return {}
+
+        monkeypatch.setattr(server.colmap_processor, "process", slow_process)
+        assert client.post("/api/projects/stream_project/process-colmap", json={}).status_code == 200
+
+        response = client.post(
+            "/api/projects/stream_project/upload-images",
+            params={"streaming": True},
+            files=[("files", ("0001.jpg", b"jpeg", "image/jpeg"))]
+        )
+        assert response.status_code == 409
+        client.portal.call(asyncio.sleep, 0.3)
+
+    def test_streaming_upload_extracts_with_upload_settings(self, client, monkeypatch, tmp_path):
+        """Test streamed uploads are extracted in batches with the settings sent along"""
+        import asyncio
+        import server
+
+        calls = []
+
+        async def extract_features(**kwargs):
+            calls.append((kwargs, server.gpu_semaphore.locked()))
+
+        monkeypatch.setattr(server, "projects_dir", tmp_path)
+        monkeypatch.setattr(server.colmap_processor, "extract_features", extract_features)
+        (tmp_path / "stream_upload" / "images").mkdir(parents=True)
+
+        response = client.post(
+            "/api/projects/stream_upload/upload-images",
+            params={"streaming": True, "camera_model": "OPENCV", "max_gpus": 1},
+            files=[("files", (f"{i:04d}.jpg", b"jpeg", "image/jpeg")) for i in range(3)]
+        )
+        assert response.status_code == 200
+        client.portal.call(asyncio.sleep, 0.1)
+
+        names = sorted(name for kwargs, _ in calls for name in kwargs["image_names"])
+        assert names == ["0000.jpg", "0001.jpg", "0002.jpg"]
+        for kwargs, held_gpu in calls:
+            assert kwargs["camera_model"] == "OPENCV"
+            assert kwargs["max_gpus"] == 1
+            assert kwargs["covariant_features"] is False
+            # MAX_GPU_JOBS defaults to 1, so the batch held the only slot
+            assert held_gpu
+
+    def test_streamed_image_dropped_once_job_starts(self, client, monkeypatch):
+        """Test an image saved after a job was accepted is not queued for extraction"""
+        import asyncio
+        import server
+
+        async def slow_process(**kwargs):
+            await asyncio.sleep(0.2)
+            return {}
+
+        async def queue():
+            return server.queue_feature_extraction("late_upload", "0001.jpg", {})
+
+        monkeypatch.setattr(server.colmap_processor, "process", slow_process)
+        assert client.post("/api/projects/late_upload/process-colmap", json={}).status_code == 200
+
+        assert client.portal.call(queue) is False
+        assert "late_upload" not in server.feature_workers
+        assert "late_upload" not in server.feature_queues
+        client.portal.call(asyncio.sleep, 0.3)
+
+
 class TestCOLMAPConfig:
     """Test COLMAP configuration"""
     
@@ -86,6 +238,460 @@ class TestCOLMAPConfig:
         for model in valid_models:
             assert model in ["PINHOLE", "RADIAL", "OPENCV", "SIMPLE_RADIAL"]
 
+    def test_matcher_selection(self, tmp_path):
+        """Test matcher is chosen from image count and ordering"""
+        from colmap_wrapper import COLMAPProcessor, EXHAUSTIVE_MATCHING_MAX_IMAGES
+
+        processor = COLMAPProcessor()
+        for i in range(EXHAUSTIVE_MATCHING_MAX_IMAGES):
+            (tmp_path / f"{i:04d}.jpg").touch()
+
+        assert processor._select_matcher(tmp_path, "auto", False) == "exhaustive"
+        assert processor._select_matcher(tmp_path, "auto", True) == "sequential"
+        assert processor._select_matcher(tmp_path, "vocab_tree", False) == "vocab_tree"
+
+        (tmp_path / "extra.jpg").touch()
+        assert processor._select_matcher(tmp_path, "auto", False) == "vocab_tree"
+
+    def test_statistics_from_text_model(self, tmp_path):
+        """Test reconstruction statistics skip the COLMAP comment header"""
+        from colmap_wrapper import COLMAPProcessor
+
+        model_path = tmp_path / "0"
+        model_path.mkdir()
+        (model_path / "cameras.txt").write_text(
+            "# Camera list with one line of data per camera:\n"
+            "# Number of cameras: 1\n"
+            "1 PINHOLE 640 480 500 500 320 240\n"
+        )
+        (model_path / "images.txt").write_text(
+            "# Image list with two lines of data per image:\n"
+            "1 1 0 0 0 0 0 0 1 a.jpg\n"
+            "100 200 -1\n"
+            "2 1 0 0 0 0 0 0 1 b.jpg\n"
+            "\n"
+        )
+        (model_path / "points3D.txt").write_text(
+            "# 3D point list with one line of data per point:\n"
+            "1 0 0 0 255 255 255 0.5 1 0\n"
+            "2 1 1 1 255 255 255 0.5 1 0"
+        )
+
+        stats = COLMAPProcessor()._get_statistics(tmp_path)
+        assert stats == {"num_cameras": 1, "num_images": 2, "num_points": 2}
+
+    def test_statistics_from_binary_model(self, tmp_path):
+        """Test reconstruction statistics read the binary model headers"""
+        import struct
+        from colmap_wrapper import COLMAPProcessor
+
+        model_path = tmp_path / "0"
+        model_path.mkdir()
+        for name, count in [("cameras", 1), ("images", 120), ("points3D", 45000)]:
+            (model_path / f"{name}.bin").write_bytes(struct.pack("<Q", count))
+
+        stats = COLMAPProcessor()._get_statistics(tmp_path)
+        assert stats == {"num_cameras": 1, "num_images": 120, "num_points": 45000}
+
+    def test_largest_reconstruction(self, tmp_path):
+        """Test the sub-reconstruction with the most points is used"""
+        from colmap_wrapper import COLMAPProcessor
+
+        for name, size in [("0", 64), ("1", 4096), ("2", 512)]:
+            (tmp_path / name).mkdir()
+            (tmp_path / name / "points3D.bin").write_bytes(b"\0" * size)
+
+        assert COLMAPProcessor._largest_reconstruction(tmp_path) == tmp_path / "1"
+        assert COLMAPProcessor._largest_reconstruction(tmp_path / "0") is None
+
+    def test_run_command_streams_progress(self):
+        """Test COLMAP output is streamed and progress lines are broadcast"""
+        import asyncio
+        from colmap_wrapper import COLMAPProcessor
+
+        class FakeManager:
+            def __init__(self):
+                self.messages = []
+
+            async def broadcast(self, message):
+                self.messages.append(message)
+
+        manager = FakeManager()
+        processor = COLMAPProcessor(websocket_manager=manager)
+        output = asyncio.run(processor._run_command([
+            "sh", "-c", "echo 'Processed file [1/4]'; echo 'Elapsed time' >&2"
+        ]))
+
+        assert "Elapsed time" in output
+        assert manager.messages == [{"type": "colmap_progress", "stage": "-c", "pct": 25.0}]
+
+    @staticmethod
+    def fake_pycolmap(calls):
+        """pycolmap stand-in recording the calls and options it receives"""
+        import types
+
+        class SiftExtractionOptions:
+            def __init__(self):
+                self.max_num_features = 8192
+                self.estimate_affine_shape = False
+                self.domain_size_pooling = False
+
+        class SiftMatchingOptions:
+            def __init__(self):
+                self.guided_matching = False
+                self.max_ratio = 0.8
+
+        class ExhaustiveMatchingOptions:
+            def __init__(self):
+                self.block_size = 50
+
+        def record(name):
+            def call(*args, **kwargs):
+                calls.append((name, args, kwargs))
+            return call
+
+        return types.SimpleNamespace(
+            Device=types.SimpleNamespace(cpu="cpu", auto="auto"),
+            SiftExtractionOptions=SiftExtractionOptions,
+            SiftMatchingOptions=SiftMatchingOptions,
+            ExhaustiveMatchingOptions=ExhaustiveMatchingOptions,
+            extract_features=record("extract_features"),
+            match_exhaustive=record("match_exhaustive"),
+            match_sequential=record("match_sequential"),
+            match_vocabtree=record("match_vocabtree")
+        )
+
+    @pytest.mark.parametrize("gpu_flag,use_gpu,device", [
+        ("SiftExtraction", "0", "cpu"),
+        ("FeatureExtraction", "0", "cpu"),
+        ("FeatureExtraction", "1", "auto")
+    ])
+    def test_pycolmap_extraction_options(self, monkeypatch, gpu_flag, use_gpu, device):
+        """Test CLI extraction flags become pycolmap options, from either flag group"""
+        import colmap_wrapper
+        from colmap_wrapper import COLMAPProcessor
+
+        calls = []
+        monkeypatch.setattr(colmap_wrapper, "pycolmap", self.fake_pycolmap(calls))
+        COLMAPProcessor()._run_pycolmap([
+            "colmap", "feature_extractor",
+            "--database_path", "database.db",
+            "--image_path", "images",
+            "--ImageReader.camera_model", "OPENCV",
+            f"--{gpu_flag}.use_gpu", use_gpu,
+            "--SiftExtraction.max_num_features", "4096",
+            "--FeatureExtraction.estimate_affine_shape", "1",
+            "--SiftExtraction.domain_size_pooling", "false",
+            "--SiftExtraction.unknown_option", "1"
+        ])
+
+        [(name, args, kwargs)] = calls
+        assert name == "extract_features"
+        assert args == ("database.db", "images")
+        assert kwargs["camera_model"] == "OPENCV"
+        assert kwargs["device"] == device
+        sift_options = kwargs["sift_options"]
+        assert sift_options.max_num_features == 4096
+        assert sift_options.estimate_affine_shape is True
+        assert sift_options.domain_size_pooling is False
+        assert not hasattr(sift_options, "use_gpu")
+
+    def test_pycolmap_matching_options(self, monkeypatch):
+        """Test CLI matching flags reach the sift and matcher specific pycolmap options"""
+        import colmap_wrapper
+        from colmap_wrapper import COLMAPProcessor
+
+        calls = []
+        monkeypatch.setattr(colmap_wrapper, "pycolmap", self.fake_pycolmap(calls))
+        COLMAPProcessor()._run_pycolmap([
+            "colmap", "exhaustive_matcher",
+            "--database_path", "database.db",
+            "--FeatureMatching.use_gpu", "0",
+            "--SiftMatching.guided_matching", "True",
+            "--FeatureMatching.max_ratio", "0.7",
+            "--ExhaustiveMatching.block_size", "25"
+        ])
+
+        [(name, args, kwargs)] = calls
+        assert name == "match_exhaustive"
+        assert args == ("database.db",)
+        assert kwargs["device"] == "cpu"
+        assert kwargs["sift_options"].guided_matching is True
+        assert kwargs["sift_options"].max_ratio == 0.7
+        assert kwargs["matching_options"].block_size == 25
+
+    def test_pycolmap_stage_reports_completion(self, monkeypatch):
+        """Test a stage run through pycolmap broadcasts that it finished"""
+        import asyncio
+        from colmap_wrapper import COLMAPProcessor
+
+        messages = []
+
+        class FakeManager:
+            async def broadcast(self, message):
+                messages.append(message)
+
+        processor = COLMAPProcessor(websocket_manager=FakeManager())
+        processor.use_pycolmap = True
+        monkeypatch.setattr(processor, "_run_pycolmap", lambda cmd: "")
+        asyncio.run(processor._run_command(["colmap", "mapper"]))
+
+        assert messages == [{"type": "colmap_progress", "stage": "mapper", "pct": 100.0}]
+
+    @pytest.mark.parametrize("output, prefix", [
+        ("COLMAP 3.9.1 (Commit 0d9f6d5 with CUDA)", "SiftExtraction"),
+        ("COLMAP 3.12.0 (Commit 6a8b3ac with CUDA)", "FeatureExtraction"),
+    ])
+    def test_gpu_flag_prefix_from_version(self, monkeypatch, output, prefix):
+        """Test GPU option names follow the installed COLMAP version"""
+        import subprocess
+        from colmap_wrapper import COLMAPProcessor
+
+        monkeypatch.setattr(
+            subprocess, "run",
+            lambda *args, **kwargs: subprocess.CompletedProcess(args, 0, output, "")
+        )
+        processor = COLMAPProcessor()
+
+        assert asyncio.run(processor.check_colmap_installation())
+        assert processor._extraction_flag_prefix == prefix
+
+    def test_colmap_check_is_cached(self, monkeypatch):
+        """Test colmap --version is only run once, off the event loop, and timeouts count as missing"""
+        import subprocess
+        import threading
+        from colmap_wrapper import COLMAPProcessor
+
+        calls = []
+
+        def hang(*args, **kwargs):
+            calls.append((kwargs["timeout"], threading.current_thread() is threading.main_thread()))
+            raise subprocess.TimeoutExpired(args[0], kwargs["timeout"])
+
+        monkeypatch.setattr(subprocess, "run", hang)
+        processor = COLMAPProcessor()
+
+        async def check_twice():
+            return [await processor.check_colmap_installation() for _ in range(2)]
+
+        assert asyncio.run(check_twice()) == [False, False]
+        assert calls == [(5, False)]
+
+    @pytest.mark.parametrize("covariant_features", [False, True])
+    def test_covariant_features_are_opt_in(self, monkeypatch, covariant_features):
+        """Test CPU-only covariant SIFT is only requested when asked for"""
+        import asyncio
+        import colmap_wrapper
+        from colmap_wrapper import COLMAPProcessor
+
+        processor = COLMAPProcessor()
+        processor.version = (3, 9)
+        commands = []
+
+        async def record(cmd):
+            commands.append(cmd)
+
+        monkeypatch.setattr(processor, "_run_command", record)
+        monkeypatch.setattr(colmap_wrapper, "get_gpu_count", lambda: 1)
+        asyncio.run(processor._feature_extraction(
+            Path("images"), Path("database.db"), "PINHOLE",
+            covariant_features=covariant_features
+        ))
+
+        cmd = commands[0]
+        assert cmd[cmd.index("--SiftExtraction.use_gpu") + 1] == "1"
+        assert ("--SiftExtraction.domain_size_pooling" in cmd) == covariant_features
+        assert ("--SiftExtraction.estimate_affine_shape" in cmd) == covariant_features
+
+    def test_vocab_tree_download_times_out(self, tmp_path, monkeypatch):
+        """Test a server that never answers fails the download instead of hanging"""
+        import asyncio
+        import socket
+        import colmap_wrapper
+        from colmap_wrapper import COLMAPProcessor
+
+        # Accepts connections but never sends a response
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        port = server.getsockname()[1]
+
+        monkeypatch.setattr(colmap_wrapper, "VOCAB_TREE_URL", f"http://127.0.0.1:{port}/tree.bin")
+        monkeypatch.setattr(colmap_wrapper, "VOCAB_TREE_CACHE_DIR", tmp_path)
+        monkeypatch.setattr(colmap_wrapper, "VOCAB_TREE_SOCKET_TIMEOUT", 0.2)
+        try:
+            assert asyncio.run(COLMAPProcessor()._get_vocab_tree()) is None
+        finally:
+            server.close()
+        assert list(tmp_path.iterdir()) == []
+
+    @pytest.mark.parametrize("max_gpus, gpu_index", [(None, None), (1, "0"), (2, "0,1"), (8, "0,1,2,3")])
+    def test_max_gpus_limits_extraction_and_matching(self, tmp_path, monkeypatch, max_gpus, gpu_index):
+        """Test max_gpus is passed to COLMAP as gpu_index, and left to COLMAP otherwise"""
+        import asyncio
+        import colmap_wrapper
+        from colmap_wrapper import COLMAPProcessor
+
+        processor = COLMAPProcessor()
+        commands = []
+
+        async def record(cmd):
+            commands.append(cmd)
+
+        monkeypatch.setattr(processor, "_run_command", record)
+        monkeypatch.setattr(colmap_wrapper, "get_gpu_count", lambda: 4)
+
+        async def run():
+            await processor._feature_extraction(
+                tmp_path, tmp_path / "database.db", "PINHOLE", max_gpus=max_gpus
+            )
+            await processor._feature_matching(
+                tmp_path / "database.db", tmp_path, "high", "exhaustive", max_gpus=max_gpus
+            )
+
+        asyncio.run(run())
+
+        for cmd, flag in zip(commands, ["--SiftExtraction.gpu_index", "--SiftMatching.gpu_index"]):
+            if gpu_index is None:
+                assert flag not in cmd
+            else:
+                assert cmd[cmd.index(flag) + 1] == gpu_index
+
+    @pytest.mark.parametrize("quality, fast, pruned", [
+        ("high", False, False),
+        ("medium", False, False),
+        ("low", False, True),
+        ("high", True, True)
+    ])
+    def test_mapper_presets(self, tmp_path, monkeypatch, quality, fast, pruned):
+        """Test low quality and fast mode reduce the mapper's bundle adjustment"""
+        import asyncio
+        from colmap_wrapper import COLMAPProcessor
+
+        processor = COLMAPProcessor()
+        commands = []
+
+        async def record(cmd):
+            commands.append(cmd)
+
+        monkeypatch.setattr(processor, "_run_command", record)
+        asyncio.run(processor._sparse_reconstruction(
+            tmp_path / "database.db", tmp_path, tmp_path / "sparse", quality, fast
+        ))
+
+        [cmd] = commands
+        assert cmd[1] == "mapper"
+        flags = dict(zip(cmd[2::2], cmd[3::2]))
+        mapper_flags = {flag: value for flag, value in flags.items() if flag.startswith("--Mapper.")}
+        if pruned:
+            assert mapper_flags["--Mapper.ba_global_max_num_iterations"] == "10"
+            assert mapper_flags["--Mapper.ba_global_images_ratio"] == "1.32"
+            assert mapper_flags["--Mapper.ba_local_max_num_iterations"] == "15"
+        else:
+            assert mapper_flags == {}
+
+    @pytest.mark.parametrize("quality, max_image_size, window_radius", [
+        ("draft", "1000", "3"),
+        ("normal", "2000", "5"),
+        ("extreme", "-1", "5"),
+        ("unknown", "2000", "5")
+    ])
+    @pytest.mark.parametrize("gpu_count, max_gpus, gpu_index", [
+        (4, None, "0,1,2,3"),
+        (4, 2, "0,1"),
+        (0, None, "0")
+    ])
+    def test_patch_match_quality_and_gpus(
+        self, tmp_path, monkeypatch, quality, max_image_size, window_radius,
+        gpu_count, max_gpus, gpu_index
+    ):
+        """Test PatchMatch stereo gets the quality tier's settings and spreads over the GPUs"""
+        import asyncio
+        import colmap_wrapper
+        from colmap_wrapper import COLMAPProcessor
+
+        processor = COLMAPProcessor()
+        commands = []
+
+        async def record(cmd):
+            commands.append(cmd)
+
+        monkeypatch.setattr(processor, "_run_command", record)
+        monkeypatch.setattr(colmap_wrapper, "get_gpu_count", lambda: gpu_count)
+        asyncio.run(processor.dense_reconstruction(tmp_path, quality, max_gpus))
+
+        [patch_match, fusion] = commands
+        assert patch_match[1] == "patch_match_stereo"
+        assert fusion[1] == "stereo_fusion"
+        flags = dict(zip(patch_match[2::2], patch_match[3::2]))
+        assert flags["--PatchMatchStereo.gpu_index"] == gpu_index
+        assert flags["--PatchMatchStereo.max_image_size"] == max_image_size
+        assert flags["--PatchMatchStereo.window_radius"] == window_radius
+
+    def test_gpu_count_is_cached(self, monkeypatch):
+        """Test nvidia-smi is only queried once per processor"""
+        import asyncio
+        import colmap_wrapper
+        from colmap_wrapper import COLMAPProcessor
+
+        calls = []
+
+        def count():
+            calls.append(1)
+            return 2
+
+        monkeypatch.setattr(colmap_wrapper, "get_gpu_count", count)
+        processor = COLMAPProcessor()
+
+        async def run():
+            return [await processor.get_gpu_count() for _ in range(3)]
+
+        assert asyncio.run(run()) == [2, 2, 2]
+        assert calls == [1]
+
+
+class TestMeshProcessing:
+    """Test mesh post-processing"""
+    
+    def test_laplacian_smooth_matches_trimesh(self):
+        """Test sparse smoothing matches trimesh's Laplacian filter"""
+        import numpy as np
+        import trimesh
+        from mesh_extractor import laplacian_smooth
+
+        mesh = trimesh.creation.icosphere(subdivisions=3)
+        mesh.vertices += np.random.default_rng(0).normal(0, 0.01, mesh.vertices.shape)
+        expected = trimesh.smoothing.filter_laplacian(mesh.copy(), iterations=5)
+
+        smoothed = laplacian_smooth(mesh.copy(), iterations=5)
+        assert np.allclose(smoothed.vertices, expected.vertices)
+
+    def test_decimation_skipped_without_open3d(self, monkeypatch):
+        """Test target_faces is ignored with a warning when open3d is missing"""
+        import trimesh
+        import mesh_extractor
+        from mesh_extractor import MeshExtractor
+
+        monkeypatch.setattr(mesh_extractor, "HAS_OPEN3D", False)
+        mesh = trimesh.creation.icosphere(subdivisions=3)
+
+        processed = MeshExtractor()._post_process_mesh(mesh, target_faces=100)
+
+        assert len(processed.faces) == 1280
+
+    def test_write_ply_binary_round_trip(self, tmp_path):
+        """Test the numpy PLY writer produces a file trimesh reads back"""
+        import numpy as np
+        import trimesh
+        from mesh_extractor import write_ply_binary
+
+        mesh = trimesh.creation.icosphere(subdivisions=2)
+        write_ply_binary(tmp_path / "mesh.ply", mesh.vertices, mesh.faces)
+
+        loaded = trimesh.load(tmp_path / "mesh.ply", process=False)
+        assert np.allclose(loaded.vertices, mesh.vertices, atol=1e-6)
+        assert np.array_equal(loaded.faces, mesh.faces)
+
 
 class TestTrainingConfig:
     """Test training configuration"""
@@ -99,13 +705,334 @@ class TestTrainingConfig:
         assert config["batch_size"] > 0
         assert 0 < config["learning_rate"] < 1
 
+    def test_generate_config(self, sample_project_config, tmp_path):
+        """Test the generated Neuralangelo config reflects the project settings"""
+        import yaml
+        from training_manager import TrainingManager
+
+        config_file = TrainingManager()._generate_config(str(tmp_path), sample_project_config)
+
+        with open(config_file) as f:
+            generated = yaml.safe_load(f)
+        assert generated["name"] == "test_project"
+        assert generated["arch"]["encoding"]["levels"] == 16
+        assert generated["model"]["surface"]["isosurface"]["resolution"] == 512
+        assert generated["optim"]["lr"] == 0.001
+        assert generated["trainer"]["max_iter"] == 10000
+        assert generated["trainer"]["batch_size"] == 2
+        assert generated["data"]["root"] == str(tmp_path / "colmap" / "dense")
+
+
+    def test_list_checkpoints_rescans_on_change(self, tmp_path):
+        """Test cached checkpoint listings follow the checkpoint directory"""
+        import os
+        from training_manager import TrainingManager
+
+        training_manager = TrainingManager()
+        assert training_manager.list_checkpoints(str(tmp_path)) == []
+
+        checkpoint_path = tmp_path / "checkpoints"
+        checkpoint_path.mkdir()
+        (checkpoint_path / "iter_10000.pth").touch()
+        assert training_manager.list_checkpoints(str(tmp_path)) == ["iter_10000.pth"]
+
+        (checkpoint_path / "iter_20000.pth").touch()
+        # Force a distinct mtime even on filesystems with coarse timestamps
+        stat = checkpoint_path.stat()
+        os.utime(checkpoint_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert training_manager.list_checkpoints(str(tmp_path)) == [
+            "iter_10000.pth", "iter_20000.pth"
+        ]
+
+
+class FakeWebSocketManager:
+    """Records broadcast messages instead of sending them"""
+
+    def __init__(self, clients=1):
+        self.messages = []
+        self.client_count = clients
+
+    async def broadcast(self, message):
+        self.messages.append(message)
+
+    async def broadcast_bytes(self, payload):
+        self.messages.append(json.loads(payload))
+
+
+class TestTrainingMonitor:
+    """Test training output monitoring"""
+    
+    def run_monitor(self, tmp_path, script, track_stats=False):
+        import asyncio
+        import psutil
+        from training_manager import TrainingManager
+
+        training_manager = TrainingManager()
+        websocket_manager = FakeWebSocketManager()
+
+        async def monitor():
+            process = await asyncio.create_subprocess_exec(
+                "sh", "-c", script,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            training_manager.active_trainings["scene"] = {"process": process, "status": "running"}
+            if track_stats:
+                training_manager.active_trainings["scene"]["psutil"] = psutil.Process(process.pid)
+            await training_manager._monitor_training(
+                "scene", process, websocket_manager, tmp_path / "train.log"
+            )
+
+        asyncio.run(monitor())
+        return training_manager, websocket_manager.messages
+
+    def test_process_stats_are_recorded(self, tmp_path):
+        """Test CPU and memory of the training process are polled while it runs"""
+        training_manager, _ = self.run_monitor(tmp_path, "sleep 0.2", track_stats=True)
+
+        status = training_manager.get_status("scene")
+        assert status["memory_rss"] > 0
+        assert status["cpu_percent"] >= 0
+        # Served by /status, so the process handles must stay out
+        assert "process" not in status and "psutil" not in status
+        json.dumps(status)
+
+    def test_output_is_batched(self, tmp_path):
+        """Test progress lines are coalesced into batch messages"""
+        training_manager, messages = self.run_monitor(
+            tmp_path, "echo 'iter: 1, loss: 0.5'; echo banner; echo 'iter: 2, loss: 0.25'"
+        )
+
+        assert messages[-1] == {"type": "training_complete", "project": "scene"}
+        items = [item for m in messages[:-1] for item in m["items"]]
+        assert all(m["type"] == "training_batch" for m in messages[:-1])
+        assert [i["message"] for i in items if i["type"] == "training_log"] == [
+            "iter: 1, loss: 0.5", "iter: 2, loss: 0.25"
+        ]
+        assert items[-1]["data"] == {"iteration": 2, "loss": 0.25}
+        assert training_manager.active_trainings["scene"]["status"] == "completed"
+
+    def test_output_is_written_to_log_and_sampled(self, tmp_path):
+        """Test every line reaches train.log while only a sample is broadcast"""
+        from training_manager import TRAINING_BROADCAST_EVERY
+
+        _, messages = self.run_monitor(
+            tmp_path, f"for i in $(seq 1 {TRAINING_BROADCAST_EVERY * 2}); do echo line $i; done"
+        )
+
+        items = [item for m in messages[:-1] for item in m["items"]]
+        assert [i["message"] for i in items] == [
+            f"line {TRAINING_BROADCAST_EVERY}", f"line {TRAINING_BROADCAST_EVERY * 2}"
+        ]
+        logged = (tmp_path / "train.log").read_text().splitlines()
+        assert logged == [f"line {i}" for i in range(1, TRAINING_BROADCAST_EVERY * 2 + 1)]
+
+    def test_signals_reach_the_process_group(self):
+        """Test pause, resume and stop apply to the trainer's child processes too"""
+        import asyncio
+        import os
+        import psutil
+        from training_manager import TrainingManager
+
+        training_manager = TrainingManager()
+
+        async def run():
+            process = await asyncio.create_subprocess_exec(
+                "sh", "-c", "sleep 30 & wait", start_new_session=True
+            )
+            training_manager.active_trainings["scene"] = {
+                "process": process,
+                "pgid": os.getpgid(process.pid)
+            }
+            await asyncio.sleep(0.2)
+            worker = psutil.Process(process.pid).children()[0]
+
+            await training_manager.pause_training("scene")
+            await asyncio.sleep(0.1)
+            paused = worker.status()
+            await training_manager.resume_training("scene")
+            await asyncio.sleep(0.1)
+            resumed = worker.status()
+            await training_manager.stop_training("scene")
+            return worker, paused, resumed
+
+        worker, paused, resumed = asyncio.run(run())
+        assert paused == psutil.STATUS_STOPPED
+        assert resumed != psutil.STATUS_STOPPED
+        worker.wait(timeout=5)
+        assert not worker.is_running()
+
+    def test_shutdown_stops_trainers(self, monkeypatch):
+        """Test app shutdown stops trainers, which run outside the server's process group"""
+        import asyncio
+        import os
+        import server
+        from training_manager import TrainingManager
+
+        training_manager = TrainingManager()
+        monkeypatch.setattr(server, "training_manager", training_manager)
+
+        async def run():
+            process = await asyncio.create_subprocess_exec(
+                "sh", "-c", "sleep 30 & wait", start_new_session=True
+            )
+            training_manager.active_trainings["scene"] = {
+                "process": process,
+                "pgid": os.getpgid(process.pid)
+            }
+            async with server.lifespan(server.app):
+                pass
+            return process
+
+        process = asyncio.run(run())
+        assert process.returncode is not None
+        assert training_manager.active_trainings["scene"]["status"] == "stopped"
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="sched_setaffinity is Linux only")
+    def test_cpu_affinity_pins_trainer(self, sample_project_config, tmp_path, monkeypatch):
+        """Test cpu_affinity pins the trainer and sizes its thread pools"""
+        import asyncio
+        import os
+        from training_manager import TrainingManager
+
+        training_manager = TrainingManager(neuralangelo_path=str(tmp_path))
+        monkeypatch.setattr(
+            training_manager, "_prepare_training_command",
+            lambda *args: ["sh", "-c", "sleep 0.2; echo threads $OMP_NUM_THREADS"]
+        )
+        config = {**sample_project_config, "cpu_affinity": [0]}
+
+        async def run():
+            await training_manager.start_training(str(tmp_path), config, FakeWebSocketManager())
+            pid = training_manager.active_trainings["test_project"]["process"].pid
+            affinity = os.sched_getaffinity(pid)
+            await training_manager.wait_for_training("test_project")
+            await asyncio.sleep(0.1)
+            return affinity
+
+        assert asyncio.run(run()) == {0}
+        assert "threads 1" in (tmp_path / "logs" / "train.log").read_text()
+
+    @pytest.mark.skipif(not sys.platform.startswith("linux"), reason="sched_setaffinity is Linux only")
+    def test_unavailable_cpu_affinity_is_rejected(self, sample_project_config, tmp_path, monkeypatch):
+        """Test an unusable cpu_affinity fails before any trainer is spawned"""
+        import asyncio
+        import os
+        from training_manager import TrainingManager
+
+        training_manager = TrainingManager(neuralangelo_path=str(tmp_path))
+        marker = tmp_path / "spawned"
+        monkeypatch.setattr(
+            training_manager, "_prepare_training_command",
+            lambda *args: ["sh", "-c", f"touch {marker}; sleep 30"]
+        )
+        cpu = max(os.sched_getaffinity(0)) + 1
+        websocket_manager = FakeWebSocketManager()
+
+        with pytest.raises(ValueError):
+            asyncio.run(training_manager.start_training(
+                str(tmp_path), {**sample_project_config, "cpu_affinity": [cpu]}, websocket_manager
+            ))
+
+        assert training_manager.active_trainings == {}
+        assert not marker.exists()
+        assert websocket_manager.messages[-1]["type"] == "training_error"
+
+    def test_trainer_killed_when_setup_fails(self, sample_project_config, tmp_path, monkeypatch):
+        """Test a trainer is not left running when start_training fails after spawning it"""
+        import asyncio
+        import psutil
+        from training_manager import TrainingManager
+
+        training_manager = TrainingManager(neuralangelo_path=str(tmp_path))
+        monkeypatch.setattr(
+            training_manager, "_prepare_training_command",
+            lambda *args: ["sh", "-c", "sleep 30"]
+        )
+        spawned = []
+
+        def failing_process(pid):
+            spawned.append(pid)
+            raise RuntimeError("setup failed")
+
+        monkeypatch.setattr(psutil, "Process", failing_process)
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(training_manager.start_training(
+                str(tmp_path), sample_project_config, FakeWebSocketManager()
+            ))
+
+        assert training_manager.active_trainings == {}
+        assert not psutil.pid_exists(spawned[0])
+
+    @pytest.mark.parametrize("line, expected", [
+        (b"iter: 1000, loss: 0.0234", {"iteration": 1000, "loss": 0.0234}),
+        (b"iter: 20, lr: 0.001, loss: 2.5e-3", {"iteration": 20, "loss": 0.0025}),
+        (b"Loading checkpoint", None),
+    ])
+    def test_parse_training_output(self, line, expected):
+        """Test iteration and loss are parsed from raw output lines"""
+        from training_manager import TrainingManager
+
+        assert TrainingManager()._parse_training_output(line) == expected
+
+    def test_stderr_is_drained(self, tmp_path):
+        """Test stderr is read alongside stdout so a chatty trainer never blocks"""
+        # Far more than a pipe buffer holds on stderr before the progress line
+        training_manager, messages = self.run_monitor(
+            tmp_path, "head -c 1000000 /dev/zero | tr '\\0' 'x' 1>&2; echo 'iter: 5, loss: 0.1'"
+        )
+
+        assert messages[-1] == {"type": "training_complete", "project": "scene"}
+        assert training_manager.active_trainings["scene"]["iteration"] == 5
+        assert "iter: 5, loss: 0.1" in (tmp_path / "train.log").read_text()
+
+    def test_batch_dropped_without_clients(self):
+        """Test nothing is encoded or sent while no client is connected"""
+        import asyncio
+        from collections import deque
+        from training_manager import TrainingManager
+
+        websocket_manager = FakeWebSocketManager(clients=0)
+        batch = {"logs": deque(["iter: 1, loss: 0.5"]), "progress": {"iteration": 1, "loss": 0.5}}
+
+        asyncio.run(TrainingManager()._send_training_batch("scene", batch, websocket_manager))
+
+        assert websocket_manager.messages == []
+        assert not batch["logs"] and batch["progress"] is None
+
+    def test_carriage_returns_split_lines(self, tmp_path):
+        """Test progress bar redraws separated by \\r are handled as lines"""
+        training_manager, messages = self.run_monitor(
+            tmp_path, "printf 'iter: 1, loss: 0.5\\riter: 2, loss: 0.25\\r\\n' 1>&2"
+        )
+
+        items = [item for m in messages[:-1] for item in m["items"]]
+        assert [i["message"] for i in items if i["type"] == "training_log"] == [
+            "iter: 1, loss: 0.5", "iter: 2, loss: 0.25"
+        ]
+        assert training_manager.active_trainings["scene"]["iteration"] == 2
+        assert (tmp_path / "train.log").read_text().splitlines() == [
+            "iter: 1, loss: 0.5", "iter: 2, loss: 0.25"
+        ]
+
+    def test_unterminated_last_line(self, tmp_path):
+        """Test output without a trailing newline is still processed"""
+        _, messages = self.run_monitor(tmp_path, "printf 'iter: 1, loss: 0.5\\niter: 2, loss: 0.25'")
+
+        items = [item for m in messages[:-1] for item in m["items"]]
+        assert [i["message"] for i in items if i["type"] == "training_log"] == [
+            "iter: 1, loss: 0.5", "iter: 2, loss: 0.25"
+        ]
+
 
 class TestFileUpload:
     """Test file upload functionality"""
     
-    def test_upload_images_no_files(self):
+    @pytest.mark.asyncio
+    async def test_upload_images_no_files(self, async_client):
         """Test upload with no files"""
-        response = client.post(
+        response = await async_client.post(
             "/api/projects/test_project/upload-images",
             files=[]
         )
@@ -116,7 +1043,7 @@ class TestFileUpload:
 class TestWebSocket:
     """Test WebSocket connections"""
     
-    def test_websocket_connection(self):
+    def test_websocket_connection(self, client):
         """Test WebSocket can connect"""
         with client.websocket_connect("/ws") as websocket:
             # Should connect successfully
@@ -125,27 +1052,123 @@ class TestWebSocket:
             data = websocket.receive_json()
             assert data["type"] == "heartbeat"
 
+    def test_broadcast_drops_failed_clients(self):
+        """Test broadcast reaches every client and prunes dead ones"""
+        import asyncio
+        from server import ConnectionManager
+
+        class FakeWebSocket:
+            def __init__(self, fail=False):
+                self.fail = fail
+                self.sent = []
+                self.closed = False
+
+            async def accept(self):
+                pass
+
+            async def send_text(self, data):
+                if self.fail:
+                    raise RuntimeError("connection closed")
+                self.sent.append(data)
+
+            async def close(self):
+                self.closed = True
+
+        async def run():
+            manager = ConnectionManager()
+            alive, dead = FakeWebSocket(), FakeWebSocket(fail=True)
+            await manager.connect(alive)
+            await manager.connect(dead)
+            await manager.broadcast({"type": "training_log", "message": "iter: 1"})
+            await asyncio.sleep(0.01)
+            return manager, alive, dead
+
+        manager, alive, dead = asyncio.run(run())
+
+        assert json.loads(alive.sent[0]) == {"type": "training_log", "message": "iter: 1"}
+        assert manager.active_connections == [alive]
+        assert dead.closed and not alive.closed
+
+    def test_broadcast_does_not_wait_on_slow_clients(self):
+        """Test a stalled client drops frames instead of blocking broadcast"""
+        import asyncio
+        from server import ConnectionManager, WS_QUEUE_SIZE
+
+        class StalledWebSocket:
+            async def accept(self):
+                pass
+
+            async def send_text(self, data):
+                await asyncio.Event().wait()
+
+        async def run():
+            manager = ConnectionManager()
+            websocket = StalledWebSocket()
+            await manager.connect(websocket)
+            await asyncio.wait_for(asyncio.gather(*[
+                manager.broadcast({"type": "training_log", "message": str(i)})
+                for i in range(WS_QUEUE_SIZE * 2)
+            ]), timeout=1)
+            queued = manager._queues[websocket].qsize()
+            manager.disconnect(websocket)
+            return queued
+
+        assert asyncio.run(run()) <= WS_QUEUE_SIZE
+
+    def test_stalled_client_is_dropped(self, monkeypatch):
+        """Test a client that cannot take a frame within the send timeout is disconnected"""
+        import asyncio
+        import server
+        from server import ConnectionManager
+
+        class StalledWebSocket:
+            closed = False
+
+            async def accept(self):
+                pass
+
+            async def send_text(self, data):
+                await asyncio.Event().wait()
+
+            async def close(self):
+                self.closed = True
+
+        monkeypatch.setattr(server, "WS_SEND_TIMEOUT", 0.05)
+        websocket = StalledWebSocket()
+
+        async def run():
+            manager = ConnectionManager()
+            await manager.connect(websocket)
+            await manager.broadcast({"type": "training_log", "message": "iter: 1"})
+            await asyncio.sleep(0.2)
+            return manager
+
+        manager = asyncio.run(run())
+        assert websocket.closed
+        assert manager.client_count == 0
+
 
 @pytest.mark.integration
 class TestIntegration:
     """Integration tests for complete workflows"""
     
-    def test_complete_workflow(self, sample_project_config, temp_project_dir):
+    @pytest.mark.asyncio
+    async def test_complete_workflow(self, async_client, sample_project_config, temp_project_dir):
         """Test complete project workflow"""
         config = sample_project_config.copy()
         config["project_path"] = temp_project_dir
         
         # 1. Create project
-        response = client.post("/api/projects/create", json=config)
+        response = await async_client.post("/api/projects/create", json=config)
         assert response.status_code == 200
         
-        # 2. Check project status
-        response = client.get(f"/api/projects/{config['scene_name']}/status")
-        assert response.status_code in [200, 404]  # May not exist in test env
-        
-        # 3. List projects
-        response = client.get("/api/projects")
-        assert response.status_code == 200
+        # 2. Check project status and 3. list projects, concurrently
+        status, projects = await asyncio.gather(
+            async_client.get(f"/api/projects/{config['scene_name']}/status"),
+            async_client.get("/api/projects")
+        )
+        assert status.status_code in [200, 404]  # May not exist in test env
+        assert projects.status_code == 200
 
 
 # Performance tests
@@ -153,12 +1176,13 @@ class TestIntegration:
 class TestPerformance:
     """Performance tests"""
     
-    def test_api_response_time(self):
+    @pytest.mark.asyncio
+    async def test_api_response_time(self, async_client):
         """Test API response time is acceptable"""
         import time
         
         start = time.time()
-        response = client.get("/")
+        response = await async_client.get("/")
         end = time.time()
         
         assert response.status_code == 200
@@ -1,21 +1,116 @@
 import asyncio
+import copy
 import subprocess
 import os
+import re
 import yaml
 import logging
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 import signal
 import psutil
+import orjson
+import aiofiles
+from collections import deque
+
+try:
+    from yaml import CSafeDumper
+except ImportError:
+    # PyYAML built without libyaml
+    from yaml import SafeDumper as CSafeDumper
 
 logger = logging.getLogger(__name__)
 
+# Training output is sent as one training_batch frame per interval
+TRAINING_FLUSH_INTERVAL = 0.05
+TRAINING_BATCH_MAX_LOGS = 500
+TRAINING_READ_SIZE = 65536
+TRAINING_LOG_EVERY = 1000
+# Lines without progress are broadcast only as a sample, train.log has them all
+TRAINING_BROADCAST_EVERY = 100
+TRAINING_STATS_INTERVAL = 1.0
+# Entries of active_trainings that are served as status, the rest are handles
+TRAINING_STATUS_FIELDS = ("status", "iteration", "loss", "cpu_percent", "memory_rss", "config")
+
+# Matched on raw bytes; the loss pattern only accepts parseable floats
+ITER_LOSS_RE = re.compile(
+    rb"iter[:\s]+(\d+).*?loss[:\s]+([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+)
+
+# Static part of the Neuralangelo config; _generate_config fills in the project values
+NEURALANGELO_CONFIG_TEMPLATE = {
+    "arch": {
+        "type": "neuralangelo",
+        "latent_dim": 256,
+        "encoding": {
+            "type": "hashgrid",
+            "max_resolution": 2048
+        }
+    },
+    "data": {
+        "type": "colmap",
+        "img_scale": 1.0,
+        "num_workers": 4
+    },
+    "model": {
+        "surface": {
+            "level_init": 0.5,
+            "isosurface": {
+                "method": "mt",
+                "chunk": 1000000
+            }
+        },
+        "object": {
+            "sdf": {
+                "encoding": {
+                    "coarse2fine": {
+                        "enabled": True,
+                        "init_active_level": 4,
+                        "step": 5000
+                    }
+                },
+                "gradient": {
+                    "mode": "numerical",
+                    "taps": 4
+                }
+            }
+        },
+        "render": {
+            "type": "volsdf",
+            "num_samples": {
+                "coarse": 64,
+                "fine": 16
+            }
+        }
+    },
+    "optim": {
+        "type": "Adam",
+        "sched": {
+            "type": "two_steps_with_warmup",
+            "warm_up_end": 5000,
+            "two_steps": [300000, 400000],
+            "gamma": 0.33
+        }
+    },
+    "logging": {
+        "checkpoint_save_iter": 10000,
+        "save_checkpoint": True
+    },
+    "trainer": {
+        "amp": False
+    }
+}
+
 class TrainingManager:
     """Manages Neuralangelo training processes"""
     
     def __init__(self, neuralangelo_path: str = "./neuralangelo"):
         self.neuralangelo_path = Path(neuralangelo_path)
         self.active_trainings: Dict[str, Dict] = {}
+        self._line_count: Dict[str, int] = {}
+        self._message_prefixes: Dict[str, tuple] = {}
+        # Checkpoint names per directory, with the directory mtime they were listed at
+        self._checkpoint_cache: Dict[Path, Tuple[int, list]] = {}
     
     async def start_training(
         self,
@@ -27,31 +122,70 @@ class TrainingManager:
         project_name = config.get("scene_name", "default")
         
         try:
-            # Generate Neuralangelo config file
-            config_file = self._generate_config(project_path, config)
+            # Generate Neuralangelo config file, off the event loop since it writes to disk
+            config_file = await asyncio.to_thread(self._generate_config, project_path, config)
             
             # Prepare training command
             cmd = self._prepare_training_command(project_path, config_file, config)
             
-            # Start training process
+            # Size the trainer's thread pools to the CPUs it is pinned to
+            cpus = config.get("cpu_affinity")
+            env = os.environ.copy()
+            if cpus:
+                if hasattr(os, "sched_getaffinity"):
+                    unavailable = set(cpus) - os.sched_getaffinity(0)
+                    if unavailable:
+                        raise ValueError(f"CPUs not available for training: {sorted(unavailable)}")
+                env["OMP_NUM_THREADS"] = str(len(cpus))
+                env["MKL_NUM_THREADS"] = str(len(cpus))
+            
+            # Start training process in its own process group, so signals also
+            # reach the workers torch.distributed.run spawns
             process = await asyncio.create_subprocess_exec(
                 *cmd,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
-                cwd=str(self.neuralangelo_path)
+                cwd=str(self.neuralangelo_path),
+                env=env,
+                start_new_session=True
             )
             
-            self.active_trainings[project_name] = {
-                "process": process,
-                "status": "running",
-                "iteration": 0,
-                "loss": 0.0,
-                "config": config
-            }
+            try:
+                # Pin the launcher before it spawns workers, they inherit its CPU set
+                if cpus and hasattr(os, "sched_setaffinity"):
+                    os.sched_setaffinity(process.pid, set(cpus))
+                
+                # One handle per run, so cpu_percent() measures since the last poll
+                try:
+                    proc = psutil.Process(process.pid)
+                except psutil.Error:
+                    proc = None
+                
+                self._line_count[project_name] = 0
+                self.active_trainings[project_name] = {
+                    "process": process,
+                    "pgid": os.getpgid(process.pid),
+                    "psutil": proc,
+                    "status": "running",
+                    "iteration": 0,
+                    "loss": 0.0,
+                    "config": config
+                }
+            except Exception:
+                # Untracked, the trainer would run on in its own session with
+                # nobody reading its pipes; the session leader's pid is the pgid
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+                raise
             
             # Monitor training output
+            log_path = Path(project_path) / "logs" / "train.log"
+            log_path.parent.mkdir(parents=True, exist_ok=True)
             asyncio.create_task(
-                self._monitor_training(project_name, process, websocket_manager)
+                self._monitor_training(project_name, process, websocket_manager, log_path)
             )
             
             logger.info(f"Started training for project: {project_name}")
@@ -69,81 +203,19 @@ class TrainingManager:
         project_path = Path(project_path)
         config_file = project_path / "neuralangelo_config.yaml"
         
-        # Template for Neuralangelo config
-        neuralangelo_config = {
-            "name": config["scene_name"],
-            "arch": {
-                "type": "neuralangelo",
-                "latent_dim": 256,
-                "encoding": {
-                    "type": "hashgrid",
-                    "levels": config.get("hash_encoding_levels", 16),
-                    "max_resolution": 2048
-                }
-            },
-            "data": {
-                "type": "colmap",
-                "root": str(project_path / "colmap" / "dense"),
-                "img_scale": 1.0,
-                "num_workers": 4
-            },
-            "model": {
-                "surface": {
-                    "level_init": 0.5,
-                    "isosurface": {
-                        "method": "mt",
-                        "resolution": config.get("resolution", 1024),
-                        "chunk": 1000000
-                    }
-                },
-                "object": {
-                    "sdf": {
-                        "encoding": {
-                            "coarse2fine": {
-                                "enabled": True,
-                                "init_active_level": 4,
-                                "step": 5000
-                            }
-                        },
-                        "gradient": {
-                            "mode": "numerical",
-                            "taps": 4
-                        }
-                    }
-                },
-                "render": {
-                    "type": "volsdf",
-                    "num_samples": {
-                        "coarse": 64,
-                        "fine": 16
-                    }
-                }
-            },
-            "optim": {
-                "type": "Adam",
-                "lr": config.get("learning_rate", 0.001),
-                "sched": {
-                    "type": "two_steps_with_warmup",
-                    "warm_up_end": 5000,
-                    "two_steps": [300000, 400000],
-                    "gamma": 0.33
-                }
-            },
-            "logging": {
-                "checkpoint_save_iter": 10000,
-                "save_checkpoint": True,
-                "checkpoint_path": str(project_path / "checkpoints")
-            },
-            "trainer": {
-                "max_iter": config.get("max_iter", 500000),
-                "batch_size": config.get("batch_size", 4),
-                "amp": False
-            }
-        }
+        # Copy the shared template and overlay the project settings
+        neuralangelo_config = {"name": config["scene_name"], **copy.deepcopy(NEURALANGELO_CONFIG_TEMPLATE)}
+        neuralangelo_config["arch"]["encoding"]["levels"] = config.get("hash_encoding_levels", 16)
+        neuralangelo_config["data"]["root"] = str(project_path / "colmap" / "dense")
+        neuralangelo_config["model"]["surface"]["isosurface"]["resolution"] = config.get("resolution", 1024)
+        neuralangelo_config["optim"]["lr"] = config.get("learning_rate", 0.001)
+        neuralangelo_config["logging"]["checkpoint_path"] = str(project_path / "checkpoints")
+        neuralangelo_config["trainer"]["max_iter"] = config.get("max_iter", 500000)
+        neuralangelo_config["trainer"]["batch_size"] = config.get("batch_size", 4)
         
         # Write config file
         with open(config_file, 'w') as f:
-            yaml.dump(neuralangelo_config, f, default_flow_style=False)
+            yaml.dump(neuralangelo_config, f, Dumper=CSafeDumper, default_flow_style=False)
         
         logger.info(f"Generated config file: {config_file}")
         return str(config_file)
@@ -165,38 +237,29 @@ class TrainingManager:
         
         return cmd
     
-    async def _monitor_training(self, project_name: str, process, websocket_manager):
-        """Monitor training progress and send updates"""
+    async def _monitor_training(self, project_name: str, process, websocket_manager, log_path: Path):
+        """Monitor training progress, append raw output to log_path and send updates"""
+        # Only the latest progress is kept, old log lines drop once the batch is full
+        batch = {"logs": deque(maxlen=TRAINING_BATCH_MAX_LOGS), "progress": None}
+        finished = asyncio.Event()
+        flusher = asyncio.create_task(
+            self._flush_training_updates(project_name, batch, finished, websocket_manager)
+        )
+        stats = asyncio.create_task(self._stats_loop(project_name, finished))
         try:
-            while True:
-                line = await process.stdout.readline()
-                if not line:
-                    break
-                
-                line = line.decode().strip()
-                logger.info(f"[{project_name}] {line}")
-                
-                # Parse training output
-                progress = self._parse_training_output(line)
-                if progress:
-                    self.active_trainings[project_name].update(progress)
-                    
-                    # Send update via WebSocket
-                    await websocket_manager.broadcast({
-                        "type": "training_progress",
-                        "project": project_name,
-                        "data": progress
-                    })
-                
-                # Send log message
-                await websocket_manager.broadcast({
-                    "type": "training_log",
-                    "project": project_name,
-                    "message": line
-                })
+            # Drain stdout and stderr together, an unread pipe would fill and
+            # block the trainer
+            async with aiofiles.open(log_path, "ab") as log_file:
+                await asyncio.gather(
+                    self._pump(project_name, process.stdout, "out", log_file, batch),
+                    self._pump(project_name, process.stderr, "err", log_file, batch)
+                )
             
             # Training completed
             await process.wait()
+            finished.set()
+            await flusher
+            await stats
             self.active_trainings[project_name]["status"] = "completed"
             
             await websocket_manager.broadcast({
@@ -206,6 +269,7 @@ class TrainingManager:
             
         except Exception as e:
             logger.error(f"Error monitoring training: {e}")
+            finished.set()
             self.active_trainings[project_name]["status"] = "error"
             await websocket_manager.broadcast({
                 "type": "training_error",
@@ -213,46 +277,167 @@ class TrainingManager:
                 "message": str(e)
             })
     
-    def _parse_training_output(self, line: str) -> Optional[Dict]:
-        """Parse training output to extract metrics"""
-        try:
-            # Look for iteration and loss information
-            # Example: "iter: 1000, loss: 0.0234"
-            if "iter" in line and "loss" in line:
-                parts = line.split(",")
-                iteration = None
-                loss = None
-                
-                for part in parts:
-                    part = part.strip()
-                    if "iter" in part:
-                        iteration = int(part.split(":")[1].strip())
-                    elif "loss" in part:
-                        loss = float(part.split(":")[1].strip())
-                
-                if iteration is not None and loss is not None:
-                    return {
-                        "iteration": iteration,
-                        "loss": loss
-                    }
-        except Exception as e:
-            logger.debug(f"Could not parse line: {line}, error: {e}")
+    async def _pump(self, project_name: str, stream, kind: str, log_file, batch: Dict):
+        """Copy one output stream to the log file and handle its lines"""
+        # Read large chunks and split them, rather than one wakeup per line
+        tail = b""
+        while True:
+            chunk = await stream.read(TRAINING_READ_SIZE)
+            if not chunk:
+                break
+            
+            # tqdm progress bars redraw with \r, count each redraw as a line
+            *lines, tail = (tail + chunk).replace(b"\r", b"\n").split(b"\n")
+            if len(tail) > TRAINING_READ_SIZE:
+                # Never keep recopying an unbounded partial line
+                lines.append(tail)
+                tail = b""
+            # \r\n and consecutive redraws leave empty lines
+            lines = [raw_line for raw_line in lines if raw_line]
+            if lines:
+                # Whole lines only, so stdout and stderr interleave cleanly in the log
+                data = b"\n".join(lines)
+                await log_file.write(data + b"\n")
+                # Decoding never adds or removes newlines, so texts pair up with lines
+                texts = data.decode("utf-8", "replace").split("\n")
+                for raw_line, line in zip(lines, texts):
+                    self._handle_training_line(project_name, kind, raw_line, line.strip(), batch)
+        
+        if tail:
+            await log_file.write(tail + b"\n")
+            self._handle_training_line(
+                project_name, kind, tail, tail.decode("utf-8", "replace").strip(), batch
+            )
+    
+    def _handle_training_line(
+        self,
+        project_name: str,
+        kind: str,
+        raw_line: bytes,
+        line: str,
+        batch: Dict
+    ):
+        """Log and parse one line of training output into the pending batch"""
+        # Every line at DEBUG, only a sample at INFO
+        count = self._line_count.get(project_name, 0) + 1
+        self._line_count[project_name] = count
+        if count % TRAINING_LOG_EVERY == 0:
+            logger.info("[%s %s] %s", project_name, kind, line)
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[%s %s] %s", project_name, kind, line)
+        
+        # Parse training output
+        progress = self._parse_training_output(raw_line)
+        if progress:
+            self.active_trainings[project_name].update(progress)
+            batch["progress"] = progress
+        
+        if progress or count % TRAINING_BROADCAST_EVERY == 0:
+            batch["logs"].append(line)
+    
+    async def _flush_training_updates(
+        self,
+        project_name: str,
+        batch: Dict,
+        finished: asyncio.Event,
+        websocket_manager
+    ):
+        """Periodically send the buffered training output until training ends"""
+        while not finished.is_set():
+            try:
+                await asyncio.wait_for(finished.wait(), TRAINING_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self._send_training_batch(project_name, batch, websocket_manager)
+    
+    async def _stats_loop(self, project_name: str, finished: asyncio.Event):
+        """Record CPU and memory usage of the training process until training ends"""
+        proc = self.active_trainings[project_name].get("psutil")
+        while proc is not None and not finished.is_set():
+            try:
+                # oneshot() reads /proc once for all the attributes below
+                with proc.oneshot():
+                    cpu = proc.cpu_percent()
+                    mem = proc.memory_info().rss
+            except psutil.Error:
+                break
+            self.active_trainings[project_name].update({
+                "cpu_percent": cpu,
+                "memory_rss": mem
+            })
+            try:
+                await asyncio.wait_for(finished.wait(), TRAINING_STATS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    
+    def _get_message_prefixes(self, project_name: str) -> tuple:
+        """Encoded JSON up to the varying field of each training message kind"""
+        if project_name not in self._message_prefixes:
+            # Encoding the field as null and cutting off 'null}' leaves the prefix
+            self._message_prefixes[project_name] = tuple(
+                orjson.dumps({"type": kind, "project": project_name, field: None})[:-5]
+                for kind, field in [
+                    ("training_batch", "items"),
+                    ("training_log", "message"),
+                    ("training_progress", "data")
+                ]
+            )
+        return self._message_prefixes[project_name]
+    
+    async def _send_training_batch(self, project_name: str, batch: Dict, websocket_manager):
+        """Send buffered log lines and the latest progress as one message"""
+        # Without clients, e.g. headless training, drop the batch unencoded
+        if not websocket_manager.client_count:
+            batch["logs"].clear()
+            batch["progress"] = None
+            return
         
+        batch_prefix, log_prefix, progress_prefix = self._get_message_prefixes(project_name)
+        items = [log_prefix + orjson.dumps(line) + b"}" for line in batch["logs"]]
+        if batch["progress"]:
+            items.append(progress_prefix + orjson.dumps(batch["progress"]) + b"}")
+        batch["logs"].clear()
+        batch["progress"] = None
+        
+        if items:
+            await websocket_manager.broadcast_bytes(
+                batch_prefix + b"[" + b",".join(items) + b"]}"
+            )
+    
+    def _parse_training_output(self, line: bytes) -> Optional[Dict]:
+        """Parse training output to extract metrics"""
+        # Example: "iter: 1000, loss: 0.0234"
+        # Most lines are banners, warnings or progress bars, rule them out with
+        # substring checks before running the regex
+        if b"iter" not in line or b"loss" not in line:
+            return None
+        match = ITER_LOSS_RE.search(line)
+        if match:
+            return {
+                "iteration": int(match.group(1)),
+                "loss": float(match.group(2))
+            }
         return None
     
+    def _signal_training(self, project_name: str, sig: int):
+        """Send a signal to the whole training process group"""
+        try:
+            os.killpg(self.active_trainings[project_name]["pgid"], sig)
+        except ProcessLookupError:
+            # Every process in the group has already exited
+            pass
+    
     async def pause_training(self, project_name: str):
         """Pause training (send SIGSTOP)"""
         if project_name in self.active_trainings:
-            process = self.active_trainings[project_name]["process"]
-            os.kill(process.pid, signal.SIGSTOP)
+            self._signal_training(project_name, signal.SIGSTOP)
             self.active_trainings[project_name]["status"] = "paused"
             logger.info(f"Paused training for project: {project_name}")
     
     async def resume_training(self, project_name: str):
         """Resume training (send SIGCONT)"""
         if project_name in self.active_trainings:
-            process = self.active_trainings[project_name]["process"]
-            os.kill(process.pid, signal.SIGCONT)
+            self._signal_training(project_name, signal.SIGCONT)
             self.active_trainings[project_name]["status"] = "running"
             logger.info(f"Resumed training for project: {project_name}")
     
@@ -261,27 +446,52 @@ class TrainingManager:
         if project_name in self.active_trainings:
             process = self.active_trainings[project_name]["process"]
             
-            # Try graceful shutdown first
-            process.terminate()
+            # Try graceful shutdown first, a paused group needs SIGCONT to act on it
+            self._signal_training(project_name, signal.SIGTERM)
+            self._signal_training(project_name, signal.SIGCONT)
             try:
                 await asyncio.wait_for(process.wait(), timeout=10)
             except asyncio.TimeoutError:
                 # Force kill if not responding
-                process.kill()
+                self._signal_training(project_name, signal.SIGKILL)
                 await process.wait()
             
             self.active_trainings[project_name]["status"] = "stopped"
             logger.info(f"Stopped training for project: {project_name}")
     
+    async def stop_all(self):
+        """Stop every training that is still running, e.g. on server shutdown"""
+        # Trainers run in their own sessions, so a Ctrl+C on the server does not reach them
+        await asyncio.gather(*[
+            self.stop_training(project_name)
+            for project_name, training in list(self.active_trainings.items())
+            if training["process"].returncode is None
+        ])
+    
+    async def wait_for_training(self, project_name: str):
+        """Wait until the training process exits"""
+        if project_name in self.active_trainings:
+            await self.active_trainings[project_name]["process"].wait()
+    
     def get_status(self, project_name: str) -> Dict:
-        """Get training status"""
+        """Get training status, without the process handles"""
         if project_name in self.active_trainings:
-            return self.active_trainings[project_name]
+            training = self.active_trainings[project_name]
+            return {key: training[key] for key in TRAINING_STATUS_FIELDS if key in training}
         return {"status": "not_started"}
     
     def list_checkpoints(self, project_path: str) -> list:
         """List available checkpoints"""
         checkpoint_path = Path(project_path) / "checkpoints"
-        if checkpoint_path.exists():
-            return sorted([f.name for f in checkpoint_path.glob("*.pth")])
-        return []
\ No newline at end of file
+        try:
+            mtime = checkpoint_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return []
+        
+        # Adding, removing or renaming a checkpoint updates the directory mtime
+        cached = self._checkpoint_cache.get(checkpoint_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        checkpoints = sorted([f.name for f in checkpoint_path.glob("*.pth")])
+        self._checkpoint_cache[checkpoint_path] = (mtime, checkpoints)
+        return checkpoints
\ No newline at end of file
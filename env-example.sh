@@ -35,6 +35,7 @@ COLMAP_MAX_NUM_MATCHES=32768
 # Performance
 MAX_UPLOAD_SIZE=5368709120  # 5GB in bytes
 WORKER_PROCESSES=4
+MAX_GPU_JOBS=1  # COLMAP/training/extraction jobs allowed to run at once
 
 # Logging
 LOG_LEVEL=INFO  # DEBUG, INFO, WARNING, ERROR, CRITICAL
@@ -11,6 +11,7 @@ const NeuralAngeloGUI = () => {
   const [currentIteration, setCurrentIteration] = useState(0);
   const [currentLoss, setCurrentLoss] = useState(0);
   const [processingStatus, setProcessingStatus] = useState('idle');
+  const [colmapProgress, setColmapProgress] = useState(null);
   const [logs, setLogs] = useState([]);
   const [selectedFiles, setSelectedFiles] = useState([]);
   const [projects, setProjects] = useState([]);
@@ -29,6 +30,7 @@ const NeuralAngeloGUI = () => {
   const [colmapConfig, setColmapConfig] = useState({
     camera_model: 'PINHOLE',
     quality: 'high',
+    covariant_features: false,
     dense_reconstruction: true,
     generate_point_cloud: true,
   });
@@ -88,6 +90,10 @@ const NeuralAngeloGUI = () => {
         addLog(data.message, 'info');
         break;
       
+      case 'training_batch':
+        data.items.forEach(handleWebSocketMessage);
+        break;
+      
       case 'training_complete':
         setIsTraining(false);
         setTrainingProgress(100);
@@ -99,8 +105,15 @@ const NeuralAngeloGUI = () => {
         addLog(`Training error: ${data.message}`, 'error');
         break;
       
+      case 'colmap_progress':
+        setColmapProgress({ stage: data.stage, pct: data.pct });
+        break;
+      
       case 'colmap_status':
         setProcessingStatus(data.status);
+        if (data.status !== 'processing') {
+          setColmapProgress(null);
+        }
         addLog(data.message, data.status === 'error' ? 'error' : 'info');
         break;
       
@@ -422,6 +435,18 @@ const NeuralAngeloGUI = () => {
                     </label>
                   </div>
                   
+                  <div>
+                    <label className="flex items-center space-x-2">
+                      <input 
+                        type="checkbox" 
+                        className="w-4 h-4"
+                        checked={colmapConfig.covariant_features}
+                        onChange={(e) => setColmapConfig({...colmapConfig, covariant_features: e.target.checked})}
+                      />
+                      <span className="text-sm">Covariant SIFT features (more distinctive, extracted on CPU)</span>
+                    </label>
+                  </div>
+                  
                   <div>
                     <label className="flex items-center space-x-2">
                       <input 
@@ -478,6 +503,20 @@ const NeuralAngeloGUI = () => {
                     <span>Dense Reconstruction</span>
                     <CheckCircle className={processingStatus === 'complete' ? 'text-green-500' : 'text-gray-600'} size={20} />
                   </div>
+                  {colmapProgress && (
+                    <div className="pt-2">
+                      <div className="flex justify-between text-sm mb-2">
+                        <span>{colmapProgress.stage.replace(/_/g, ' ')}</span>
+                        <span>{colmapProgress.pct.toFixed(1)}%</span>
+                      </div>
+                      <div className="w-full bg-gray-700 rounded-full h-2">
+                        <div
+                          className="bg-green-600 h-2 rounded-full transition-all duration-300"
+                          style={{ width: `${colmapProgress.pct}%` }}
+                        ></div>
+                      </div>
+                    </div>
+                  )}
                 </div>
               </div>
             </div>